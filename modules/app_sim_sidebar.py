@@ -3,19 +3,23 @@ import streamlit as st
 import numpy as np
 import pandas as pd
 import datetime
-from random import randint, shuffle
+from random import Random, randint, shuffle
+from threading import Lock
+
+from cachetools import LRUCache
 
 
 # 1 - Data simulation functions
 # player lists
-def players_ids_list(n_players) -> list[list[int]]:
+def players_ids_list(n_players, rng : Random = None) -> list[list[int]]:
 
     """
-    Create a list of lists containing each team's players.
+    Create a list of lists containing each team's players. A seeded random.Random can be
+    given as rng for reproducible ids.
     """
     # random player ids, shuffled
     player_ids = [i for i in range(10000,100000)]
-    shuffle(player_ids)
+    (rng.shuffle if rng is not None else shuffle)(player_ids)
 
     n_first = 0
     n_last = n_players[0]
@@ -37,7 +41,7 @@ def players_ids_list(n_players) -> list[list[int]]:
 
 # create individual player
 def player_score(player_id = randint(10000, 99999), date = datetime.date.today().isoformat(),
-                 events=['A','B']) -> type[pd.DataFrame]:
+                 events=['A','B'], rng : Random = None) -> type[pd.DataFrame]:
     """
     Creates a DataFrame with a single random player and scores for each event (game)
 
@@ -46,13 +50,15 @@ def player_score(player_id = randint(10000, 99999), date = datetime.date.today()
     player_id: player unique identifier
     date: date in YYYY-MM-DD (today by default)
     events: list of str of simultaneous activities
+    rng: seeded random.Random for reproducible scores (global random by default)
     """
+    rand_score = rng.randint if rng is not None else randint
     player = pd.DataFrame(
         {
             'player_id'  : [f"{player_id}" for i in range(len(events))],
             'event_date' : [date for i in range(len(events))],
             'event_game' : events,
-            'score'      : [randint(0,3) for i in range(len(events))]
+            'score'      : [rand_score(0,3) for i in range(len(events))]
         }
     )
 
@@ -60,20 +66,20 @@ def player_score(player_id = randint(10000, 99999), date = datetime.date.today()
 
 # create a team
 def team_players(player_id= [randint(10000,99999)], date = datetime.date.today().isoformat(),
-                 events=['A','B']) -> type[pd.DataFrame]:
+                 events=['A','B'], rng : Random = None) -> type[pd.DataFrame]:
 
     """
     Creates a team score data with a given list of players with random scores for each event.
     """
     
     # creates a dataframe with the first player on list (player_id)
-    team = player_score(player_id[0], date, events)
+    team = player_score(player_id[0], date, events, rng)
     
     # if more players on list, it will concatenate this new players (from team_player[1])
     if len(player_id) > 1:
         for player in range(1, len(player_id)):
             team = pd.concat([team, # main dataframe
-                              player_score(player_id[player], date, events)
+                              player_score(player_id[player], date, events, rng)
                              ])
     # row reindex
     team.reset_index(drop = True, inplace = True)
@@ -82,13 +88,13 @@ def team_players(player_id= [randint(10000,99999)], date = datetime.date.today()
 
 # create a team with random scores
 def team_scores(player_id = [randint(10000,99999)], date = datetime.date.today().isoformat(),
-                events=['A','B']) -> type[pd.DataFrame]:
+                events=['A','B'], rng : Random = None) -> type[pd.DataFrame]:
     """
     Creates a team score data with a given list of players with random scores
     for each event, and asigns score description.
     """
 
-    team = team_players(player_id, date, events)
+    team = team_players(player_id, date, events, rng)
 
     medal = []
 
@@ -106,9 +112,114 @@ def team_scores(player_id = [randint(10000,99999)], date = datetime.date.today()
     
     return team
 
+# simulation pipeline
+def simulate_teams(date, events : list[str], teams : list[str], sizes : list[int], seed : int) -> dict:
+    """
+    Simulated data from user defined parameters. Returns a dict with all needed variables for
+    the pipeline (individual teams raw data, bool list for iteration, full df with teams raw data
+    and aggregated teams data), or None without teams or events. The same parameters and seed
+    give the same data.
+    """
+    if len(teams) < 1 or len(events) < 1:
+        return None
+
+    rng = Random(seed)
+    first_team, *other_teams = players_ids_list(sizes, rng)
+
+    df_first_team = team_scores(player_id = first_team,
+                                date = date,
+                                events=events, rng = rng)
+    df_first_team['team'] = pd.Series([teams[0] for i in range(len(df_first_team))])
+
+    *df_teams, = [pd.DataFrame() for i in range(3)]
+    bool_list = []
+
+    for l_idx in range(len(other_teams)):
+        if len(other_teams[l_idx]) > 1:
+            df_teams[l_idx] = team_scores(player_id = other_teams[l_idx],
+                                          date = date,
+                                          events=events, rng = rng)
+            df_teams[l_idx]['team'] = pd.Series([teams[1:][l_idx] for i in range(len(df_teams[l_idx]))])
+            bool_list.append(True)
+        else:
+            bool_list.append(False)
+
+    # concatenate all teams
+    df_teams_disagg = df_first_team.copy()
+    for i in range(len(bool_list)):
+        if bool_list[i] == True:
+            df_teams_disagg = pd.concat([df_teams_disagg, df_teams[i]]).reset_index(drop=True)
+
+    # teams aggregated data
+    df_teams_agg = df_teams_disagg.groupby(['event_date', 'event_game', 'team', 'medal']).sum('score').reset_index()
+
+    # full output
+    return {'teams_raw'        : [df_first_team, df_teams],
+            'bool_list'        : bool_list,
+            'all_teams_disagg' : df_teams_disagg,
+            'all_teams_agg'    : df_teams_agg}
+
+# simulation cache: LRU bounded by entries and memory, shared by all sessions of the server
+SIM_CACHE_MAX_ENTRIES = 16
+SIM_CACHE_BYTES = 2**28
+
+def sim_nbytes(sim_output : dict) -> int:
+    frames = [*sim_output['teams_raw'][1], sim_output['teams_raw'][0],
+              sim_output['all_teams_disagg'], sim_output['all_teams_agg']]
+    return int(sum(df.memory_usage(index=True, deep=True).sum() for df in frames))
+
+_sim_cache = LRUCache(maxsize = SIM_CACHE_BYTES, getsizeof = sim_nbytes)
+_sim_lock = Lock()
+_sim_key_locks = {}
+
+def data_sim(date, events : list[str], teams : list[str], sizes : list[int], seed : int,
+             max_entries : int = SIM_CACHE_MAX_ENTRIES) -> dict:
+    """
+    Function
+    -
+    Cached simulate_teams, keyed on (date, events, teams, sizes, seed). The cache keeps at most
+    max_entries simulations and SIM_CACHE_BYTES of DataFrames (least recently used are evicted),
+    and concurrent sessions asking for the same key wait for a single simulation.
+    Each call returns copies of the cached DataFrames, so the pipeline can modify them.
+    """
+    # nothing to simulate, no key lock taken
+    if len(teams) < 1 or len(events) < 1:
+        return None
+
+    key = (str(date), tuple(events), tuple(teams), tuple(sizes), seed)
+
+    with _sim_lock:
+        key_lock = _sim_key_locks.setdefault(key, Lock())
+
+    try:
+        with key_lock:
+            with _sim_lock:
+                sim_output = _sim_cache.get(key)
+
+            if sim_output is None:
+                sim_output = simulate_teams(date, events, teams, sizes, seed)
+
+                with _sim_lock:
+                    if sim_nbytes(sim_output) <= SIM_CACHE_BYTES:
+                        _sim_cache[key] = sim_output
+                    while len(_sim_cache) > max_entries:
+                        _sim_cache.popitem()
+    finally:
+        with _sim_lock:
+            _sim_key_locks.pop(key, None)
+
+    return {'teams_raw'        : [sim_output['teams_raw'][0].copy(), [df.copy() for df in sim_output['teams_raw'][1]]],
+            'bool_list'        : list(sim_output['bool_list']),
+            'all_teams_disagg' : sim_output['all_teams_disagg'].copy(),
+            'all_teams_agg'    : sim_output['all_teams_agg'].copy()}
+
 #----------------------------------------------------------------------------------------
 
 # 2 - Sidebar: user inputs
+def next_seed() -> None:
+    # "Ready to go!" callback: new simulation with the same parameters
+    st.session_state['sim_seed'] = (st.session_state.get('sim_seed', 0) + 1) % 2**31
+
 def side_bar_params() -> tuple[dict,int]:
     st.sidebar.header("Simulate some data!")
 
@@ -147,68 +258,16 @@ def side_bar_params() -> tuple[dict,int]:
                 team_d = st.sidebar.slider(f"4th team size (max: {n_player_base-team_a-team_b-team_c})",
                                             0, n_player_base-team_a-team_b-team_c)
 
-    # clear cache
-    if st.sidebar.button(":material/restart_alt: Ready to go!"):
-        st.cache_data.clear()
-    
-    # Iterable data from inputs for simulation
+    # simulation seed, a new draw with the same parameters on "Ready to go!"
+    st.sidebar.number_input("Simulation seed", 0, 2**31 - 1, key = 'sim_seed')
+    st.sidebar.button(":material/restart_alt: Ready to go!", on_click = next_seed)
 
-    input_n_players = [team_a, team_b, team_c, team_d]
-    first_team, *teams = players_ids_list(input_n_players)
-          
-        
-    # 3 - Simulation pipeline
-    @st.cache_data(ttl= '1h')
-    def data_sim() -> dict:
-        """
-        Simulated data from user defined parameters. Returns a dict with all needed variables for
-        the pipeline (individual teams raw data, bool list for iteration, full df with teams raw data
-        and aggregated teams data)
-        """
-        if len(team_names_input)>=1 and len(events_input)>=1:
-            df_first_team = team_scores(player_id = first_team,
-                                        date = date_input,
-                                        events=events_input)
-            df_first_team['team'] = pd.Series([team_names_input[0] for i in range(len(df_first_team))])
-
-            *df_teams, = [pd.DataFrame() for i in range(3)]
-            bool_list = []
-
-            for l_idx in range(len(teams)):
-                if len(teams[l_idx]) > 1:
-                    df_teams[l_idx] = team_scores(player_id = teams[l_idx],
-                                                date = date_input,
-                                                events=events_input)
-                    df_teams[l_idx]['team'] = pd.Series([team_names_input[1:][l_idx] for i in range(len(df_teams[l_idx]))])
-                    bool_list.append(True)
-                else:
-                    bool_list.append(False)
-
-            # concatenate all teams
-            df_teams_disagg = df_first_team.copy()
-            for i in range(len(bool_list)):
-                if bool_list[i] == True:
-                    df_teams_disagg = pd.concat([df_teams_disagg, df_teams[i]]).reset_index(drop=True)
-                        
-            # teams aggregated data
-            df_teams_agg = df_teams_disagg.groupby(['event_date', 'event_game', 'team', 'medal']).sum('score').reset_index()
-
-            # full output
-            data_sim_output = {
-                'teams_raw' : [df_first_team, df_teams],
-                'bool_list' : bool_list,
-                'all_teams_disagg' :df_teams_disagg,
-                'all_teams_agg' : df_teams_agg
-                }
-
-            del df_first_team, df_teams, bool_list, df_teams_disagg, df_teams_agg
-                        
-            return data_sim_output
-        else:
-            pass
-            
-    
-    simulated_data = data_sim()
+    # Iterable data from inputs for simulation (cached by parameters and seed, shared by sessions)
+    simulated_data = data_sim(date   = date_input,
+                              events = events_input,
+                              teams  = team_names_input,
+                              sizes  = [team_a, team_b, team_c, team_d],
+                              seed   = st.session_state['sim_seed'])
 
     return simulated_data, n_player_base
 
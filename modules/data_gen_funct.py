@@ -350,98 +350,40 @@ def polar_data(df_disagg, df_agg, path, empty_leaf=None):
         single value (None by default).
     """
 
-    # prep params
-    levels = len(path)
-
-
     # 1 - Build etiquettes -----------------------------------------------
 
-    # aux lists
-    aux_id, aux_parent, aux_label, aux_value = [],[],[],[]
-
     # grouped df based on value counts, bypass bias from "score" and categorical columns
-    df_gb = df_disagg.copy().value_counts(subset=path).reset_index()\
+    df_gb = df_disagg.value_counts(subset=path).reset_index()\
     .sort_values(path, ascending=True, ignore_index=True)
 
     ## CORRECCION 1
     df_gb.columns = ['event_game', 'team_played', 'medal', 'count']
+    lv_str = [df_gb[p].astype(str) for p in path]
 
-    # for full ring
-    if empty_leaf == None:
-        # insert values to aux_value
-        aux_value = df_gb['count'].to_list()
-            
-        # for zip pack
-        lv_iter = [tuple(df_gb[p]) for p in path]
-        *lv, last = lv_iter
-                
-        # fill lists with level etiquettes
-        for lv0,lv1,lv2 in zip(*lv, last):
-            aux_id.append(f"{lv0}/{lv1}/{lv2}")
-            aux_parent.append(f"{lv0}/{lv1}")
-            aux_label.append(lv2)
-        
-        # for chart customization purposes
-        len_lv2 = len(aux_id)
-            
-        # for fragmented ring
-    else:
-        aux_df = df_gb[df_gb[path[-1]] != empty_leaf]
-            
-        # insert values to aux_value, excluding where the ring won't be filled
-        aux_value = aux_df['count'].to_list()
-            
-            # for zip pack
-        lv_iter = [tuple(aux_df[p]) for p in path]
-        *lv, last = lv_iter
-                
-        for lv0,lv1,lv2 in zip(*lv, last):
-            aux_id.append(f"{lv0}/{lv1}/{lv2}")
-            aux_parent.append(f"{lv0}/{lv1}")
-            aux_label.append(lv2)
-        
-        len_lv2 = len(aux_id)
+    # outer ring: for fragmented ring, exclude where the ring won't be filled
+    leaf = np.full(len(df_gb), True) if empty_leaf == None else (df_gb[path[-1]] != empty_leaf).to_numpy()
+    ids_lv2 = (lv_str[0] + '/' + lv_str[1] + '/' + lv_str[2])[leaf]
+    parents_lv2 = (lv_str[0] + '/' + lv_str[1])[leaf]
+    labels_lv2 = df_gb[path[-1]][leaf]
 
     ## CORRECCION 2 EN len_lv1
-    #----- middle ring: repeats the process, sustracting the outer label
-    levels -= 1
-    path = path[:levels]
-            
-    # groupby and sort values
-    df_gb = df_gb.groupby(path).sum('count').reset_index()
-    df_gb.sort_values(by=path[levels::-1], ascending=True, ignore_index=True, inplace=True)
-            
-    # update zip
-    lv_iter = [tuple(df_gb[p]) for p in path]
-    *lv, last = lv_iter
-            
-    # build level
-    aux_value.extend(df_gb['count'].to_list())
-            
-    for lv0,lv1 in zip(*lv, last):
-        aux_id.append(f"{lv0}/{lv1}")
-        aux_parent.append(f"{lv0}")
-        aux_label.append(lv1)
-        
-    len_lv1 = len(aux_id)
-
-    #----- inner circle: base labels
-    levels -= 1
-    path = path[:levels]
-            
-    # groupby and sort values
-    df_gb = df_gb.groupby(path).sum('count').reset_index()
-    df_gb.sort_values(by=path[levels::-1], ascending=True, ignore_index=True, inplace=True)
-            
-    # build level
-    aux_value.extend(df_gb['count'].to_list())
-    lv_iter = df_gb[path].values.flatten().tolist()
-            
-    for lv0 in lv_iter:
-        aux_id.append(lv0)
-        aux_parent.append("")
-        aux_label.append(lv0)
-        
+    # middle ring: repeats the process, sustracting the outer label
+    df_lv1 = df_gb.groupby(path[:2]).sum('count').reset_index()\
+    .sort_values(by=path[1::-1], ascending=True, ignore_index=True)
+    parents_lv1 = df_lv1[path[0]].astype(str)
+
+    # inner circle: base labels
+    df_lv0 = df_lv1.groupby(path[:1]).sum('count').reset_index()\
+    .sort_values(by=path[:1], ascending=True, ignore_index=True)
+
+    aux_id     = [*ids_lv2, *(parents_lv1 + '/' + df_lv1[path[1]].astype(str)), *df_lv0[path[0]]]
+    aux_parent = [*parents_lv2, *parents_lv1, *([""]*len(df_lv0))]
+    aux_label  = [*labels_lv2, *df_lv1[path[1]], *df_lv0[path[0]]]
+    aux_value  = [*df_gb['count'][leaf], *df_lv1['count'], *df_lv0['count']]
+
+    # level lengths, for chart customization purposes
+    len_lv2 = len(ids_lv2)
+    len_lv1 = len_lv2 + len(df_lv1)
     len_lv0 = len(aux_id)
 
     # 2 - Build Hovertemplate --------------------------------------------------
@@ -469,32 +411,35 @@ def polar_data(df_disagg, df_agg, path, empty_leaf=None):
     custdata_lv0 = df_agg[['event_game','medal_frequence']].groupby(['event_game'])\
                                         .sum('medal_frequence').reset_index()
     
-    # 2.b - Hover template
-    
-    hover_lv2 = [f"<b>{custdata_lv2['medal'].at[i].capitalize()} medal</b><br>"+
-                f"<i>Medal count</i>: {custdata_lv2['medal_frequence'].at[i]}<br>"+
-                f"<i>Medal rel. frequence</i>: {custdata_lv2['medal_relative'].at[i]}%<br>"+
-                f"<br><b>Medal Score Methods</b><br>"+
-                f"<i>Accumulative</i>: {custdata_lv2['acc_w_score'].at[i]}<br>"+
-                f"<i>Performance</i>: {custdata_lv2['performance_score'].at[i]}<br>"+
-                f"<extra><b>Team<br>{custdata_lv2['team'].at[i]}<br>medals</b></extra>" for i in range(len_lv2)]
-
-    hover_lv1 = [f"<b>{custdata_lv1['team'].at[i].capitalize()}</b><br>"+
-                f"<i>Player count</i>: {custdata_lv1['medal_frequence'].at[i]}<br>"+
-                f"<i>Team participation</i>: {custdata_lv1['player_ratio'].at[i]}%<br>"+
-                f"<br><b>Team Score Methods</b><br>"+
-                f"<i>Accumulative</i>: {custdata_lv1['acc_w_score_total'].at[i]}<br>"+
-                f"<i>Performance</i>: {custdata_lv1['performance_score_total'].at[i]}<br>"+
-                f"<extra><b>In event<br>{aux_parent[len_lv2 : len_lv1][i]}</b></extra>" for i in range(len_lv1 - len_lv2)]
-    hover_lv0 = [f"<b>Event {custdata_lv0['event_game'].at[i].capitalize()}</b><br>"+
-                f"<i>Player count</i>: {custdata_lv0['medal_frequence'].at[i]}<br>"+
-                f"<i>Event participation</i>: func_placeholder %" for i in range(len_lv0 - len_lv1)]
+    # 2.b - Hover template (vectorized string concatenation per level)
+    c_lv2 = custdata_lv2.iloc[:len_lv2].astype(str)
+    hover_lv2 = ("<b>" + c_lv2['medal'].str.capitalize() + " medal</b><br>"+
+                "<i>Medal count</i>: " + c_lv2['medal_frequence'] + "<br>"+
+                "<i>Medal rel. frequence</i>: " + c_lv2['medal_relative'] + "%<br>"+
+                "<br><b>Medal Score Methods</b><br>"+
+                "<i>Accumulative</i>: " + c_lv2['acc_w_score'] + "<br>"+
+                "<i>Performance</i>: " + c_lv2['performance_score'] + "<br>"+
+                "<extra><b>Team<br>" + c_lv2['team'] + "<br>medals</b></extra>").to_list()
+
+    c_lv1 = custdata_lv1.iloc[:len_lv1 - len_lv2].astype(str)
+    hover_lv1 = ("<b>" + c_lv1['team'].str.capitalize() + "</b><br>"+
+                "<i>Player count</i>: " + c_lv1['medal_frequence'] + "<br>"+
+                "<i>Team participation</i>: " + c_lv1['player_ratio'] + "%<br>"+
+                "<br><b>Team Score Methods</b><br>"+
+                "<i>Accumulative</i>: " + c_lv1['acc_w_score_total'] + "<br>"+
+                "<i>Performance</i>: " + c_lv1['performance_score_total'] + "<br>"+
+                "<extra><b>In event<br>" + parents_lv1.to_numpy()[:len(c_lv1)] + "</b></extra>").to_list()
+
+    c_lv0 = custdata_lv0.iloc[:len_lv0 - len_lv1].astype(str)
+    hover_lv0 = ("<b>Event " + c_lv0['event_game'].str.capitalize() + "</b><br>"+
+                "<i>Player count</i>: " + c_lv0['medal_frequence'] + "<br>"+
+                "<i>Event participation</i>: func_placeholder %").to_list()
 
     # func_placeholder: round(event_compr[i]*100,2)
 
     lv_hovertemplate = hover_lv2 + hover_lv1 + hover_lv0
 
     # clear catche
-    del df_gb, lv_iter, len_lv0, len_lv1, len_lv2, levels, custdata_lv0, custdata_lv1, custdata_lv2, hover_lv0, hover_lv1, hover_lv2
+    del df_gb, df_lv0, df_lv1, lv_str, len_lv0, len_lv1, len_lv2, custdata_lv0, custdata_lv1, custdata_lv2, hover_lv0, hover_lv1, hover_lv2
 
     return aux_id, aux_label, aux_parent, aux_value, lv_hovertemplate
\ No newline at end of file
@@ -1,13 +1,257 @@
+import hashlib
+import re
+import warnings
+from functools import wraps
+from threading import Lock
+
 import pandas as pd
 import numpy as np
+import plotly
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import plotly.io as pio
 
+from cachetools import LRUCache
+
+import streamlit as st
+
+
+# Figure payload------------------------------------------------------------------
+
+# plotly >= 6 serializes numpy arrays as base64 typed arrays, so compact dtypes shrink the JSON too
+TYPED_ARRAYS = int(plotly.__version__.split('.')[0]) >= 6
+
+# serialized size (bytes) from where a figure payload warning is raised
+FIGURE_PAYLOAD_LIMIT = 2**21
+
+def compact_array(values, decimals : int = 4) -> np.ndarray | None:
+    """
+    Function
+    -
+    Rounds float arrays to the given decimals, and with typed arrays also downcasts them to float32
+    and integers to their smallest dtype. Returns None for non numeric (or ragged) values.
+    """
+    try:
+        arr = np.asarray(values)
+    except ValueError:
+        return None
+
+    match arr.dtype.kind:
+        case 'f':
+            arr = np.round(arr, decimals)
+            return arr.astype(np.float32) if TYPED_ARRAYS else arr
+        case 'i' | 'u':
+            if TYPED_ARRAYS and arr.size > 0:
+                downcast = 'unsigned' if arr.min() >= 0 else 'integer'
+                arr = pd.to_numeric(arr.ravel(), downcast = downcast).reshape(arr.shape)
+            return arr
+        case _:
+            return None
+
+def _compact_props(props : dict, decimals : int) -> dict:
+    # numeric arrays of a trace (nested properties included), customdata aside
+    compact = {}
+    for k, v in props.items():
+        if k in ('type', 'customdata', 'hovertemplate'):
+            continue
+        if isinstance(v, dict):
+            sub = _compact_props(v, decimals)
+            if sub:
+                compact[k] = sub
+        elif isinstance(v, (list, tuple, np.ndarray)) and len(v) > 1:
+            arr = compact_array(v, decimals)
+            if arr is not None:
+                compact[k] = arr
+
+    return compact
+
+def compact_customdata(customdata, hovertemplate : str, decimals : int = 4) -> tuple:
+    """
+    Function
+    -
+    Shrinks a trace customdata: columns with a single value in the whole trace are written once in
+    the hovertemplate (only when they are shown without format), and the remaining columns of
+    numbers are rounded. String columns are never converted. Returns the new customdata (None if every column was inlined) and hovertemplate.
+    """
+    cd = np.asarray(customdata, dtype=object)
+    if cd.size == 0 or cd.ndim > 2 or not isinstance(hovertemplate, str):
+        return customdata, hovertemplate
+
+    one_dim = cd.ndim == 1
+    cd = cd.reshape(len(cd), -1)
+    refs = re.findall(r"%\{customdata(?:\[(\d+)\])?([^}]*)\}", hovertemplate)
+
+    keep, inline = [], {}
+    for j in range(cd.shape[1]):
+        plain = all(fmt == '' for idx, fmt in refs if int(idx or 0) == j)
+        if plain and (cd[:, j] == cd[0, j]).all():
+            value = cd[0, j]
+            inline[j] = np.format_float_positional(round(value, decimals), trim='-')\
+                if isinstance(value, (float, np.floating)) else str(value)
+        else:
+            keep.append(j)
+    new_index = {j : i for i, j in enumerate(keep)}
+
+    def rewrite(ref):
+        j = int(ref.group(1) or 0)
+        if j in inline:
+            return inline[j]
+        if one_dim and len(keep) == 1:
+            return "%{customdata" + ref.group(2) + "}"
+        return "%{customdata[" + str(new_index[j]) + "]" + ref.group(2) + "}"
+
+    hovertemplate = re.sub(r"%\{customdata(?:\[(\d+)\])?([^}]*)\}", rewrite, hovertemplate)
+
+    if len(keep) == 0:
+        return None, hovertemplate
+
+    # only columns of numbers are compacted, strings (ids included) are kept as they are
+    columns = []
+    for j in keep:
+        numeric = pd.api.types.infer_dtype(cd[:, j]) in ('integer', 'floating', 'mixed-integer-float')
+        columns.append(compact_array(cd[:, j].tolist(), decimals) if numeric else cd[:, j])
+
+    if all(c.dtype != object for c in columns):
+        cd = np.column_stack(columns)
+    else:
+        cd = np.column_stack([c.astype(object) for c in columns])
+
+    return (cd[:, 0] if one_dim and len(keep) == 1 else cd), hovertemplate
+
+def compact_figure(fig : go.Figure, decimals : int = 4) -> go.Figure:
+    """
+    Function
+    -
+    Payload optimisation of a figure (in place): numeric trace arrays are rounded and downcast
+    (see compact_array) and customdata is shrunk (see compact_customdata). Other trace properties
+    and the layout are untouched.
+    """
+    for trace in fig.data:
+        props = trace.to_plotly_json()
+        update = _compact_props(props, decimals)
+
+        if props.get('customdata') is not None:
+            update['customdata'], update['hovertemplate'] = compact_customdata(
+                props['customdata'], props.get('hovertemplate'), decimals)
+
+        if update:
+            trace.update(update)
+
+    return fig
+
+def figure_payload(fig : go.Figure | str, name : str) -> int:
+    """
+    Function
+    -
+    Size in bytes of the serialized figure (a Figure or its JSON), kept by name in the session
+    (see payload_sizes). A RuntimeWarning is raised when it goes over FIGURE_PAYLOAD_LIMIT.
+    """
+    fig_json = fig if isinstance(fig, str) else fig.to_json()
+    n_bytes = len(fig_json.encode())
+    st.session_state.setdefault('payload_sizes', {})[name] = n_bytes
+
+    if n_bytes > FIGURE_PAYLOAD_LIMIT:
+        warnings.warn(f"{name} figure payload is {n_bytes/2**20:.1f} MB "+
+                      f"(limit {FIGURE_PAYLOAD_LIMIT/2**20:.1f} MB)", RuntimeWarning)
+
+    return n_bytes
+
+def payload_sizes() -> pd.Series:
+    """
+    Function
+    -
+    Last serialized size (bytes) of each figure reported in the session, largest first.
+    """
+    return pd.Series(st.session_state.get('payload_sizes', {}), name = 'bytes', dtype = int)\
+        .sort_values(ascending = False)
+
+#------------------------------------------------------------------------------
+
+# Figure cache------------------------------------------------------------------
+
+# serialized figures, bounded by their total JSON size (LRU eviction)
+FIGURE_CACHE_BYTES = 2**26
+_figure_cache = LRUCache(maxsize = FIGURE_CACHE_BYTES, getsizeof = len)
+_figure_lock = Lock()
+
+# content key of figure inputs
+def data_fingerprint(*objs) -> str:
+    """
+    Function
+    -
+    Content hash of figure and model inputs: DataFrames and Series (values, index, columns and
+    dtypes), numpy arrays of any shape, and any nesting of lists, tuples and dicts of them. Other
+    values are hashed by their repr.
+    """
+    digest = hashlib.blake2b(digest_size = 16)
+
+    def update(obj):
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            frame = obj.to_frame() if isinstance(obj, pd.Series) else obj
+            digest.update(str((type(obj).__name__, frame.shape, list(frame.columns),
+                               frame.dtypes.astype(str).to_list())).encode())
+            digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+        elif isinstance(obj, np.ndarray):
+            digest.update(str(('ndarray', obj.shape, obj.dtype.str)).encode())
+            if obj.dtype.kind == 'O':
+                digest.update(pd.util.hash_array(obj.ravel()).tobytes())
+            else:
+                digest.update(np.ascontiguousarray(obj).data)
+        elif isinstance(obj, pd.Index):
+            update(pd.Series(np.asarray(obj)))
+        elif isinstance(obj, (list, tuple)):
+            digest.update(f"{type(obj).__name__}{len(obj)}".encode())
+            for item in obj:
+                update(item)
+        elif isinstance(obj, dict):
+            digest.update(f"dict{len(obj)}".encode())
+            for k in sorted(obj, key=str):
+                update(k)
+                update(obj[k])
+        else:
+            digest.update(repr(obj).encode())
+
+    for obj in objs:
+        update(obj)
+
+    return digest.hexdigest()
+
+def figure_cache(builder):
+    """
+    Decorator
+    -
+    Caches a figure builder by a content hash of its inputs (see data_fingerprint). The figure
+    is compacted (see compact_figure) and stored as Plotly JSON in a bounded LRU cache
+    (FIGURE_CACHE_BYTES), so reruns with the same data slice and parameters skip the build. Its
+    payload size is reported under the builder name (see payload_sizes). Every call returns a
+    new figure, so callers can update it without changing the cached one.
+    """
+    @wraps(builder)
+    def cached_builder(*args, **kwargs):
+        key = (builder.__module__, builder.__qualname__, data_fingerprint(args, kwargs))
+        with _figure_lock:
+            fig_json = _figure_cache.get(key)
+
+        if fig_json is None:
+            fig_json = compact_figure(builder(*args, **kwargs)).to_json()
+            if len(fig_json) <= FIGURE_CACHE_BYTES:
+                with _figure_lock:
+                    _figure_cache[key] = fig_json
+
+        # sizes are kept by session, so cached figures are reported too
+        figure_payload(fig_json, builder.__qualname__)
+
+        return pio.from_json(fig_json)
+
+    return cached_builder
+
+#------------------------------------------------------------------------------
+
 
 # Bar funcions------------------------------------------------------------------
 
 # Faceted bar with hline (specific score plots)
+@figure_cache
 def cust_bar_hline(df_data: pd.DataFrame,
                    x_data: str, y_data: str, facet_data_col: str, selector: str, selector_filter: str,
                    hline_values: str = None, hline_annot_iter: list = None, hline_annot: str = '', show_hline :bool = False,
@@ -47,7 +291,7 @@ def cust_bar_hline(df_data: pd.DataFrame,
     subplot_cols = list(df_data[facet_data_col].unique())
 
     template_color = pio.templates[pio.templates.default]['layout']['colorway']
-    color_theme = template_color[:len(subplot_cols)]
+    color_theme = [template_color[i % len(template_color)] for i in range(len(subplot_cols))]
 
     # Subplot figure
     bar_h_fig = make_subplots(cols = len(subplot_cols),
@@ -61,27 +305,53 @@ def cust_bar_hline(df_data: pd.DataFrame,
     bar_legendgroup = [True]
     bar_legendgroup.extend([False for e in range(len(subplot_cols[1:]))])
 
+    # filter by selector once, then a single partition by facet
+    selected_data = df_data[df_data[selector]==selector_filter]
+    facets = {k : g for k, g in selected_data.groupby(facet_data_col, sort=False, observed=True)}
+    empty = selected_data.iloc[:0]
+
     # bar
     for i in range(len(subplot_cols)):
+        facet_data = facets.get(subplot_cols[i], empty)
+
         bar_h_fig.add_trace(
             go.Bar(
-                x = df_data[df_data[selector]==selector_filter][df_data[facet_data_col]==subplot_cols[i]][x_data],
-                y = df_data[df_data[selector]==selector_filter][df_data[facet_data_col]==subplot_cols[i]][y_data].values,
+                x = facet_data[x_data],
+                y = facet_data[y_data].values,
                 name = subplot_cols[i],
                 marker_color = color_theme[i], marker_line_width = 0,
                 legendgroup = subplot_cols[i]+' bar',
-                customdata = df_data[df_data[selector]==selector_filter][df_data[facet_data_col]==subplot_cols[i]][customdata_cols],
+                customdata = facet_data[customdata_cols],
                 hovertemplate = hovertemplate
             ),row = 1, col = i+1, secondary_y = False)
-    # hline
+
+    # hline: each facet reference line is drawn across all subplots, built in a single layout update
+    # (facets without data for the selector have no reference line)
     if show_hline == True:
+        axes_refs = []
+        for j in range(len(subplot_cols)):
+            primary, secondary = [bar_h_fig.get_subplot(1, j+1, secondary_y=sec) for sec in (False, True)]
+            axes_refs.append((primary.xaxis.plotly_name.replace('axis', '') + ' domain',
+                              primary.yaxis.plotly_name.replace('axis', ''),
+                              secondary.yaxis.plotly_name.replace('axis', '')))
+
+        hline_shapes, hline_annotations = [], []
         for i in range(len(subplot_cols)):
-            bar_h_fig.add_hline(y = df_data[df_data[selector]==selector_filter][df_data[facet_data_col]==subplot_cols[i]][hline_values].unique()[0],
-                            line_color = color_theme[i],
-                            line_width = 1,
-                            annotation_text = f"{hline_annot_iter[i]}{hline_annot}",
-                            annotation_position = 'bottom left',
-                            exclude_empty_subplots=False, secondary_y=True)
+            facet_data = facets.get(subplot_cols[i], empty)
+            if len(facet_data) == 0:
+                continue
+            hline_y = facet_data[hline_values].iat[0]
+
+            for xref, yref, yref_secondary in axes_refs:
+                hline_shapes.append(dict(type = 'line', x0 = 0, x1 = 1, xref = xref,
+                                         y0 = hline_y, y1 = hline_y, yref = yref_secondary,
+                                         line = dict(color = color_theme[i], width = 1)))
+                hline_annotations.append(dict(text = f"{hline_annot_iter[i]}{hline_annot}", showarrow = False,
+                                              x = 0, xanchor = 'left', xref = xref,
+                                              y = hline_y, yanchor = 'top', yref = yref))
+
+        bar_h_fig.update_layout(shapes = hline_shapes,
+                                annotations = [*bar_h_fig.layout.annotations, *hline_annotations])
 
     # axes styling and category order
     #----- x axes
@@ -129,16 +399,11 @@ def accent_color(data : list, main_color : str, accent : str) -> list[str]:
     - main_color: HEX, CSS, rgb or rgba in str format
     - accent: HEX, CSS, rgb or rgba in str format, must share the same color format as main_color
     """
-    color_list = []
-    
-    for i in data:
-        if i != data.max():
-            color_list.append(main_color)
-        else:
-            color_list.append(accent)
+    data = np.asarray(data)
 
-    return color_list
+    return np.where(data == data.max(), accent, main_color).tolist() if len(data) > 0 else []
 
+@figure_cache
 def bar_highlights(data : pd.DataFrame, x : str, y: list, subplot_titles : list, col_group : str,legend_group : list,t : int = 50,b : int = 30,l : int = 0,r : int = 0, theme = 'plotly_white'):
     """
     Function
@@ -164,9 +429,13 @@ def bar_highlights(data : pd.DataFrame, x : str, y: list, subplot_titles : list,
                                         subplot_titles = subplot_titles,
                                         shared_yaxes=False)
 
+    # single partition by col_group
+    groups = {k : g for k, g in data.groupby(col_group, sort=False, observed=True)}
+    empty = data.iloc[:0]
+
     # bar plots
     for i in range(len(legend_group)):
-        f_data = data[data[col_group] == legend_group[i]]
+        f_data = groups.get(legend_group[i], empty)
         
         bar_metrics_subplot.add_trace(go.Bar( # facet 1
             name            = legend_group[i],
@@ -221,10 +490,67 @@ def bar_highlights(data : pd.DataFrame, x : str, y: list, subplot_titles : list,
 
 # Barpolar funcion-------------------------------------------------------------
 
+# bins for aggregated barpolar
+def barpolar_bins(values: np.ndarray, groups: np.ndarray, n_groups: int, mode: str = 'histogram',
+                  n_bins: int = 10) -> list:
+    """
+    Function
+    -
+    Vectorized binning of player values by group, for aggregated barpolar charts.
+
+    Parameters
+    -
+    - values: numerical values of each player
+    - groups: group code (0 to n_groups-1) of each player
+    - n_groups: number of groups
+    - mode: 'histogram' counts players by value bins (one bin per value when there are n_bins or
+        less distinct values) and 'quantile' averages values in n_bins equal size buckets of each
+        group
+    - n_bins: number of bins or buckets
+
+    Returns
+    -
+    A (n_groups, n_bins) array with counts ('histogram') or bucket means ('quantile'), a
+    (n_groups, n_bins) array with player counts and a list of bin labels.
+    """
+    match mode:
+        case 'histogram':
+            uniques = np.unique(values)
+            if len(uniques) <= n_bins:
+                bin_idx = np.searchsorted(uniques, values)
+                labels = [f"{u:g}" for u in uniques]
+            else:
+                edges = np.histogram_bin_edges(values, bins=n_bins)
+                bin_idx = np.clip(np.digitize(values, edges[1:-1]), 0, n_bins-1)
+                labels = [f"{lo:.3g}-{hi:.3g}" for lo, hi in zip(edges[:-1], edges[1:])]
+            counts = np.bincount(groups*len(labels) + bin_idx, minlength=n_groups*len(labels))\
+                .reshape(n_groups, len(labels))
+            return counts, counts, labels
+
+        case 'quantile':
+            # rank of each player inside its group
+            order = np.lexsort((values, groups))
+            group_size = np.bincount(groups, minlength=n_groups)
+            group_start = np.concatenate([[0], np.cumsum(group_size)[:-1]])
+            rank = np.empty(len(values), dtype=int)
+            rank[order] = np.arange(len(values)) - group_start[groups[order]]
+
+            bucket = rank * n_bins // np.maximum(group_size[groups], 1)
+            flat = groups*n_bins + bucket
+            counts = np.bincount(flat, minlength=n_groups*n_bins).reshape(n_groups, n_bins)
+            sums = np.bincount(flat, weights=values, minlength=n_groups*n_bins).reshape(n_groups, n_bins)
+            means = np.divide(sums, counts, out=np.zeros(sums.shape), where=counts > 0)
+            labels = [f"q{i+1}" for i in range(n_bins)]
+            return means, counts, labels
+
+        case _:
+            raise ValueError(f"Unknown barpolar aggregation: {mode}")
+
 def cust_barpolar(df_data: pd.DataFrame, r: str, theta: str, group_data:str, color_order: list|tuple, sortby: str|list,
                   title: str = None, customdata = None, hovertemplate = None, add_name:str = '',
                   h: int = 400, w: int = 400, hole: float = .0, theme: str = 'plotly_white',
-                  ascending: bool = True, sorted: bool = True) -> go.Figure:
+                  ascending: bool = True, sorted: bool = True,
+                  max_players: int = 2000, aggregate: str = 'histogram', n_bins: int = 10) -> go.Figure:
     """
     Function
     -
@@ -248,6 +574,11 @@ def cust_barpolar(df_data: pd.DataFrame, r: str, theta: str, group_data:str, col
     - ascending: bool = True, sorting order (False for descending order)
     - sorted: bool = True, if False, data will be in original order and other sorting params won`t
         take effect
+    - max_players: int = 2000, above this number of rows, players are aggregated in bins instead of
+        drawn as one bar each (customdata and hovertemplate are then replaced)
+    - aggregate: str = 'histogram', aggregation mode, 'histogram' (players by score bin) or 'quantile'
+        (mean score of quantile buckets), see barpolar_bins
+    - n_bins: int = 10, number of bins or buckets of each group
     """
     # copy to keep integrity
     df=df_data.copy()
@@ -263,17 +594,40 @@ def cust_barpolar(df_data: pd.DataFrame, r: str, theta: str, group_data:str, col
 
     # barpolar figure
     fig_s_barpolar = go.Figure()
-    for i in range(len(group)):
-        r_values = list(df[df[group_data] == group[i]][r])
-        t_values = list(df[df[group_data] == group[i]][theta])
-        fig_s_barpolar.add_traces(go.Barpolar(
-            name = f"{add_name}{group[i]}",
-            r = r_values,
-            theta = t_values,
-            marker_color = group_color[group[i]],
-            marker_line_color = group_color[group[i]],
-            customdata = df[df[group_data] == group[i]][customdata],
-            hovertemplate = hovertemplate))
+
+    # aggregated bars: fixed number of bars whatever the number of players
+    if len(df) > max_players:
+        group_codes = pd.Categorical(df[group_data], categories=group).codes
+        known = group_codes >= 0
+        r_bins, n_bins_players, bin_labels = barpolar_bins(df[r].to_numpy()[known], group_codes[known],
+                                                            len(group), mode=aggregate, n_bins=n_bins)
+        r_title = 'Players' if aggregate == 'histogram' else f'Mean {r}'
+        for i in range(len(group)):
+            fig_s_barpolar.add_traces(go.Barpolar(
+                name = f"{add_name}{group[i]}",
+                r = r_bins[i],
+                theta = [f"{group[i]} {label}" for label in bin_labels],
+                marker_color = group_color[group[i]],
+                marker_line_color = group_color[group[i]],
+                customdata = np.column_stack([bin_labels, n_bins_players[i]]),
+                hovertemplate = "<extra></extra>"+
+                                f"<b>{group[i]}</b><br>"+
+                                f"<i>{r} bin</i> "+"%{customdata[0]}<br>"+
+                                "<i>Players</i> %{customdata[1]}<br>"+
+                                f"<b>{r_title}</b> "+"%{r:.2f}"))
+
+    else:
+        for i in range(len(group)):
+            r_values = list(df[df[group_data] == group[i]][r])
+            t_values = list(df[df[group_data] == group[i]][theta])
+            fig_s_barpolar.add_traces(go.Barpolar(
+                name = f"{add_name}{group[i]}",
+                r = r_values,
+                theta = t_values,
+                marker_color = group_color[group[i]],
+                marker_line_color = group_color[group[i]],
+                customdata = df[df[group_data] == group[i]][customdata],
+                hovertemplate = hovertemplate))
         
     fig_s_barpolar.update_polars(
         patch = dict(
@@ -308,6 +662,9 @@ def cust_barpolar(df_data: pd.DataFrame, r: str, theta: str, group_data:str, col
         height = h, width = w
     )
     
+    compact_figure(fig_s_barpolar)
+    figure_payload(fig_s_barpolar, 'cust_barpolar')
+
     return fig_s_barpolar
 
 #------------------------------------------------------------------------------
@@ -315,6 +672,22 @@ def cust_barpolar(df_data: pd.DataFrame, r: str, theta: str, group_data:str, col
 # Sunburst function-------------------------------------------------------------
 
 # 1 - structure data path
+def path_ids(data: pd.DataFrame, cols: list[str], sep: str = '/') -> pd.Series:
+    """
+    Function
+    -
+    Joins the given columns into tree ids ("root/branch/leaf") with vectorized string concatenation.
+    An empty column list returns empty strings, i.e. the parent of root nodes.
+    """
+    if len(cols) == 0:
+        return pd.Series('', index=data.index, dtype=object)
+
+    ids = data[cols[0]].astype(str)
+    for col in cols[1:]:
+        ids = ids + sep + data[col].astype(str)
+
+    return ids
+
 def polar_data_path(data: pd.DataFrame, lv_base:str, lv_mid:str, lv_out:str, empty_leaf: str=None) -> list[pd.DataFrame, list[int]]:
 
     """
@@ -322,6 +695,7 @@ def polar_data_path(data: pd.DataFrame, lv_base:str, lv_mid:str, lv_out:str, emp
     -
     Data processing for polar charts, icicle and treemaps. Returns formated data according to given path columns,
     ideal to create subplot traces with plotly graph_objects and plotly make_subplots.
+    Ids, parents and labels are built per level with vectorized string operations (see path_ids).
 
     Parameters
     -
@@ -342,93 +716,39 @@ def polar_data_path(data: pd.DataFrame, lv_base:str, lv_mid:str, lv_out:str, emp
 
     # prep params-----------------------------------------------------------
     path = [lv_base, lv_mid, lv_out]
-    levels = len(path)
-    aux_id, aux_parent, aux_label, aux_value = [],[],[],[]
 
     # grouped df based on value counts, bypass bias from "score" and categorical columns
-    df_gb = data.copy().value_counts(subset=path).reset_index()\
+    df_gb = data.value_counts(subset=path).reset_index()\
     .sort_values(path, ascending=True, ignore_index=True)
 
     df_gb.columns = [lv_base, lv_mid, lv_out, 'count']
     #-----------------------------------------------------------------------
 
     # Leaf / Outer Level----------------------------------------------------
-    # for full ring
-    if empty_leaf == None:
-        aux_value = df_gb['count'].to_list()
-            
-        # for zip pack
-        lv_iter = [tuple(df_gb[p]) for p in path]
-        *lv, last = lv_iter
-                
-        # fill lists with level etiquettes
-        for lv0,lv1,lv2 in zip(*lv, last):
-            aux_id.append(f"{lv0}/{lv1}/{lv2}")
-            aux_parent.append(f"{lv0}/{lv1}")
-            aux_label.append(lv2)
-        
-        # for chart customization purposes
-        len_lv2 = len(aux_id)
-            
-    # for fragmented ring
-    else:
-        aux_df = df_gb[df_gb[path[-1]] != empty_leaf]
-            
-        # insert values to aux_value, excluding where the ring won't be filled
-        aux_value = aux_df['count'].to_list()
-            
-        lv_iter = [tuple(aux_df[p]) for p in path]
-        *lv, last = lv_iter
-                
-        for lv0,lv1,lv2 in zip(*lv, last):
-            aux_id.append(f"{lv0}/{lv1}/{lv2}")
-            aux_parent.append(f"{lv0}/{lv1}")
-            aux_label.append(lv2)
-        
-        len_lv2 = len(aux_id)
+    # for fragmented ring, exclude where the ring won't be filled
+    df_leaf = df_gb if empty_leaf == None else df_gb[df_gb[lv_out] != empty_leaf]
     #-----------------------------------------------------------------------
 
     # Branch / Middle Level-------------------------------------------------
-    levels -= 1
-    path = path[:levels]
-            
-    df_gb = df_gb.groupby(path).sum('count').reset_index()
-    df_gb.sort_values(by=path[levels::-1], ascending=True, ignore_index=True, inplace=True)
-            
-    lv_iter = [tuple(df_gb[p]) for p in path]
-    *lv, last = lv_iter
-            
-    # build level
-    aux_value.extend(df_gb['count'].to_list())
-            
-    for lv0,lv1 in zip(*lv, last):
-        aux_id.append(f"{lv0}/{lv1}")
-        aux_parent.append(f"{lv0}")
-        aux_label.append(lv1)
-        
-    len_lv1 = len(aux_id)
+    # branch totals keep the empty leafs, so the ring is left fragmented
+    df_branch = df_gb.groupby(path[:2], observed=True)['count'].sum().reset_index()\
+    .sort_values(by=[lv_mid, lv_base], ascending=True, ignore_index=True)
     #-----------------------------------------------------------------------
 
     # Root / Base Level-----------------------------------------------------
-    levels -= 1
-    path = path[:levels]
-            
-    df_gb = df_gb.groupby(path).sum('count').reset_index()
-    df_gb.sort_values(by=path[levels::-1], ascending=True, ignore_index=True, inplace=True)
-            
-    # build level
-    aux_value.extend(df_gb['count'].to_list())
-    lv_iter = df_gb[path].values.flatten().tolist()
-            
-    for lv0 in lv_iter:
-        aux_id.append(lv0)
-        aux_parent.append("")
-        aux_label.append(lv0)
-        
-    len_lv0 = len(aux_id)
+    df_root = df_branch.groupby(lv_base, observed=True)['count'].sum().reset_index()\
+    .sort_values(by=lv_base, ascending=True, ignore_index=True)
     #-----------------------------------------------------------------------
 
-    return pd.DataFrame({'ids':aux_id, 'parents':aux_parent, 'labels':aux_label, 'values':aux_value}), [len_lv2, len_lv1-len_lv2, len_lv0-len_lv1 ]
+    # build levels, from leaf to root
+    levels = [(df_leaf, path), (df_branch, path[:2]), (df_root, path[:1])]
+    sb_data = pd.concat([pd.DataFrame({'ids'     : path_ids(df, lv).to_numpy(),
+                                       'parents' : path_ids(df, lv[:-1]).to_numpy(),
+                                       'labels'  : df[lv[-1]].to_numpy(),
+                                       'values'  : df['count'].to_numpy()}) for df, lv in levels],
+                        ignore_index=True)
+
+    return sb_data, [len(df) for df, _ in levels]
     #-----------------------------------------------------------------------
 
 # 2 - Structure hover template
@@ -465,15 +785,32 @@ def customdata_levels(data : pd.DataFrame, col_orders : list[str], mode : str =
     return c_data
 
 # 2.2- hovertemplate structure to add in customdata patameter
+SUNBURST_HOVERTEMPLATE = ("<b>%{customdata[0]}</b><br>"+
+                          "<i>%{customdata[1]}</i>: %{customdata[2]}<br>"+
+                          "<i>%{customdata[3]}</i>: %{customdata[4]}%<br>"+
+                          "<br><b>%{customdata[5]}</b><br>"+
+                          "<i>Accumulative</i>: %{customdata[6]}<br>"+
+                          "<i>Performance</i>: %{customdata[7]:.2f}<br>"+
+                          "<extra></extra>")
+# root nodes only show the event and its players
+SUNBURST_ROOT_HOVERTEMPLATE = ("<b>%{customdata[0]}</b><br>"+
+                               "<i>%{customdata[1]}</i>: %{customdata[2]}<br>"+
+                               "<extra></extra>")
+
 def polar_customdata(data : list[pd.DataFrame], customdata_l : list[str],
                      customdata_b : list[str], customdata_r : list[str],
-                     n_rows : list[int], col_orders : list[list]) -> list[str]:
+                     n_rows : list[int], col_orders : list[list]) -> tuple[np.ndarray, np.ndarray]:
     """
     Function
     -
-    Creates a list with custom template hover data for each level rendered in a tree or polar
-    plotly plot with base, one branch and leafs (3 level depth). This function can be
-    modified according to each plotly tree-like or polar-like structure.
+    Creates the customdata array and the hovertemplates for each level rendered in a tree
+    or polar plotly plot with base, one branch and leafs (3 level depth). Level specific texts
+    (titles and labels) are stored as customdata columns, so leaf and branch nodes share a
+    template, and root nodes use a shorter one (title and player count, other columns blank):
+
+    [title, count label, count, share label, share (%), scores title, accumulative, performance]
+
+    This function can be modified according to each plotly tree-like or polar-like structure.
 
     Parameters
     -
@@ -484,6 +821,11 @@ def polar_customdata(data : list[pd.DataFrame], customdata_l : list[str],
     - n_rows: level n_rows from data path, from leaf to root
     - col_orders: list of columns used to sort each data level, must be the same order
         as in data path levels
+
+    Returns
+    -
+    A 2-D object array (customdata, one row per node from leaf to root) and the hovertemplate
+    of each node.
     """
 
     # check lenghts (avoid error)
@@ -493,38 +835,90 @@ def polar_customdata(data : list[pd.DataFrame], customdata_l : list[str],
     data_root = customdata_levels(data = data[2], col_orders = col_orders[2], mode = 'group')
 
     if len(data_leaf) != n_rows[0]:
-        return "Leaf data has not the same length as leaf data info"
+        raise ValueError("Leaf data has not the same length as leaf data info")
     if len(data_branch) != n_rows[1]:
-        return "Branch data has not the same length as branch data info"
+        raise ValueError("Branch data has not the same length as branch data info")
     if len(data_root) != n_rows[2]:
-        return "Root data has not the same length as root data info"
+        raise ValueError("Root data has not the same length as root data info")
 
     # leaf customdata-----------------------------------------------------------------
-    hover_leaf = [f"<b>{data_leaf[customdata_l[0]].at[i].capitalize()} medal</b><br>"+
-                f"<i>Medal count</i>: {data_leaf[customdata_l[1]].at[i]}<br>"+
-                f"<i>Medal relative count</i>: {data_leaf[customdata_l[2]].at[i]}%<br>"+
-                f"<br><b>Medal Score Methods</b><br>"+
-                f"<i>Accumulative</i>: {data_leaf[customdata_l[3]].at[i]}<br>"+
-                f"<i>Performance</i>: {data_leaf[customdata_l[4]].at[i]:.2f}<br>"+
-                "<extra></extra>" for i in range(n_rows[0])]
+    hover_leaf = pd.DataFrame({
+        'title'       : data_leaf[customdata_l[0]].astype(str).str.capitalize() + ' medal',
+        'count_label' : 'Medal count',
+        'count'       : data_leaf[customdata_l[1]],
+        'share_label' : 'Medal relative count',
+        'share'       : data_leaf[customdata_l[2]],
+        'scores'      : 'Medal Score Methods',
+        'acc'         : data_leaf[customdata_l[3]],
+        'perform'     : data_leaf[customdata_l[4]]})
 
     # branch customdata---------------------------------------------------------------
-    hover_branch = [f"<b>{data_branch[customdata_b[0]].at[i].capitalize()}</b><br>"+
-                    f"<i>Active team`s players</i>: {data_branch[customdata_b[1]].at[i]}<br>"+
-                    f"<i>Team participation</i>: {data_branch[customdata_b[2]].at[i]}%<br>"+
-                    f"<br><b>Team Score Methods</b><br>"+
-                    f"<i>Accumulative</i>: {data_branch[customdata_b[3]].at[i]}<br>"+
-                    f"<i>Performance</i>: {data_branch[customdata_b[4]].at[i]:.2f}<br>"+
-                    "<extra></extra>" for i in range(n_rows[1])]
+    hover_branch = pd.DataFrame({
+        'title'       : data_branch[customdata_b[0]].astype(str).str.capitalize(),
+        'count_label' : 'Active team`s players',
+        'count'       : data_branch[customdata_b[1]],
+        'share_label' : 'Team participation',
+        'share'       : data_branch[customdata_b[2]],
+        'scores'      : 'Team Score Methods',
+        'acc'         : data_branch[customdata_b[3]],
+        'perform'     : data_branch[customdata_b[4]]})
 
     # root customdata-----------------------------------------------------------------
-    hover_root = [f"<b>Event {data_root[customdata_r[0]].at[i].capitalize()}</b><br>"+
-                    f"<i>Player count</i>: {data_root[customdata_r[1]].at[i]}<br>"+
-                    "<extra></extra>" for i in range(n_rows[2])]
-
-
-    customdata_l = hover_leaf+hover_branch+hover_root
+    hover_root = pd.DataFrame({
+        'title'       : 'Event ' + data_root[customdata_r[0]].astype(str).str.capitalize(),
+        'count_label' : 'Player count',
+        'count'       : data_root[customdata_r[1]],
+        'share_label' : '',
+        'share'       : '',
+        'scores'      : '',
+        'acc'         : '',
+        'perform'     : ''})
+
+    customdata = pd.concat([hover_leaf, hover_branch, hover_root], ignore_index=True).to_numpy(dtype=object)
+    hovertemplate = np.array([SUNBURST_HOVERTEMPLATE] * (n_rows[0] + n_rows[1]) +
+                             [SUNBURST_ROOT_HOVERTEMPLATE] * n_rows[2], dtype=object)
+
+    return customdata, hovertemplate
+
+# 3 - Sunburst overview figure
+@figure_cache
+def polar_sunburst(df_disagg : pd.DataFrame, df_metrics : pd.DataFrame, w : int = 900, h : int = 400) -> go.Figure:
+    """
+    Function
+    -
+    Events > teams > medals sunburst of the simulated data, with score methods in the hover.
 
-    return customdata_l
+    Parameters
+    -
+    - df_disagg: disaggregated teams data (event_game, team and medal columns)
+    - df_metrics: aggregated teams metrics from the pipeline
+    - w, h: figure width and height
+    """
+    sb_data, lengths = polar_data_path(df_disagg, 'event_game', 'team', 'medal', empty_leaf='not played')
+
+    played = df_metrics[df_metrics['medal']!='not played']
+    sb_customdata, sb_hovertemplate = polar_customdata(
+        data         = [played.copy(), played.copy(), df_metrics.copy()],
+        customdata_l = ['medal', 'medal_abs_frequence', 'medal_rel_frequence', 'acc_w_score', 'perform_score', 'team'],
+        customdata_b = ['team', 'medal_abs_frequence', 'team_participation_ratio', 'acc_w_score_total', 'perform_score_total', 'event_game'],
+        customdata_r = ['event_game','medal_abs_frequence'],
+        n_rows       = lengths,
+        col_orders   = [['event_game', 'team', 'medal'],
+                        ['team', 'event_game', 'team_participation_ratio','acc_w_score_total', 'perform_score_total', 'medal_abs_frequence'],
+                        ['event_game','medal_abs_frequence']])
+
+    fig_sunburst = go.Figure(go.Sunburst(
+        ids          = sb_data['ids'],
+        labels       = sb_data['labels'],
+        parents      = sb_data['parents'],
+        values       = sb_data['values'],
+        branchvalues = 'total',
+        customdata   = sb_customdata,
+        hovertemplate = sb_hovertemplate ))
+
+    fig_sunburst.update_layout(
+        width = w, height = h, margin = dict(t=0, b=0, l=0, r=0))
+
+    return fig_sunburst
 
 #...
@@ -1,39 +1,407 @@
+import glob
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+from scipy import sparse
 
 import plotly.graph_objects as go
 #from plotly.subplots import make_subplots
 import plotly.io as pio
 from plotly.validators.scatter.marker import SymbolValidator
 
+import sklearn
 from sklearn.preprocessing import Normalizer
-from sklearn.metrics import silhouette_samples, silhouette_score
-from sklearn.cluster import KMeans
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+from joblib import Parallel, delayed, cpu_count
+from threadpoolctl import threadpool_limits
+from cachetools import LRUCache
 
 import streamlit as st
 
+from modules.graph_funct import figure_cache, compact_figure, data_fingerprint
+
 import warnings
 warnings.simplefilter("ignore", UserWarning)
 
 
 # Preprocess
 
-def preprocess(base : pd.DataFrame) -> list:
-    df_clust_data = base[['event_date', 'player_id', 'team', 'score', 'medal']].copy()
-    df_clust_data['player_participation'] = df_clust_data['medal'].replace({'gold':1, 'silver':1, 'bronze':1, 'not played':0})
-    df_clust_data = df_clust_data.groupby(['event_date', 'player_id', 'team']).sum(['score', 'played']).reset_index()
+# vectorized player features
+def build_features(base : pd.DataFrame, n_events : int = None, sparse_blocks : tuple = ()) -> tuple:
+    """
+    Function
+    -
+    Player features for clustering, built in a single grouped pass over factorized codes: total
+    score and participation fraction over all events, one row per (event_date, player_id, team).
+
+    Parameters
+    -
+    - base: disaggregated data, one row per player and event
+    - n_events: (default None) total number of events, counted from base if None. Must be given
+        when base is only a chunk of the full data
+    - sparse_blocks: (default ()) extra features returned as scipy sparse CSR matrices, with one
+        row per player: 'team' (team one-hot) and/or 'event_score' (score in each event)
+
+    Output
+    -
+    X (score, participation), df_clust_data and a dict {block: (sparse matrix, column labels)}
+    """
+    grouped = base.groupby(['event_date', 'player_id', 'team'], sort=True)
+    player_codes = grouped.ngroup().to_numpy()
+    players = grouped.size().index
+    event_codes, events = pd.factorize(base['event_game'])
+
+    if n_events is None:
+        n_events = len(events)
+
+    score = base['score'].to_numpy()
+    played = (base['medal'] != 'not played').to_numpy()
+
+    total_score = np.bincount(player_codes, weights=score, minlength=len(players))
+    participation = np.bincount(player_codes, weights=played, minlength=len(players)) / n_events
+
+    df_clust_data = players.to_frame(index=False)
+    df_clust_data['score'] = total_score.astype(score.dtype)
+    df_clust_data['player_participation'] = participation
+
+    X = np.column_stack([total_score, participation])
+
+    # sparse extra features
+    extra = {}
+    if 'team' in sparse_blocks:
+        team_codes, teams = pd.factorize(df_clust_data['team'])
+        one_hot = sparse.csr_matrix((np.ones(len(players)), (np.arange(len(players)), team_codes)),
+                                    shape=(len(players), len(teams)))
+        extra['team'] = (one_hot, list(teams))
+    if 'event_score' in sparse_blocks:
+        event_score = sparse.csr_matrix((score, (player_codes, event_codes)),
+                                        shape=(len(players), len(events)))
+        extra['event_score'] = (event_score, list(events))
+
+    return X, df_clust_data, extra
 
-    df_clust_data['player_participation'] = df_clust_data['player_participation'].apply(lambda x: x/len(base['event_game'].unique()))
-    df_clust_data = pd.concat([df_clust_data, pd.get_dummies(df_clust_data['team'])], axis=1)
+def preprocess(base : pd.DataFrame, n_events : int = None) -> list:
+    """
+    Function
+    -
+    Player features for clustering: total score and participation fraction over all events
+    (see build_features).
 
-    X = df_clust_data[['score', 'player_participation']].to_numpy()
-    #X = df_clust_data[['score', 'player_participation'] + list(df_clust_data['team'].unique())].to_numpy()
+    Parameters
+    -
+    - base: disaggregated data, one row per player and event
+    - n_events: (default None) total number of events, counted from base if None. Must be given
+        when base is only a chunk of the full data
+    """
+    X, df_clust_data, _ = build_features(base, n_events = n_events)
 
     return X, df_clust_data
 
+# Approximate silhouette evaluation
+
+# simplified silhouette, distances to centroids only
+def simplified_silhouette(X : np.array, labels : np.array, centroids : np.array,
+                          sample_weight : np.array = None, single_member_zero : bool = True) -> np.array:
+    """
+    Function
+    -
+    Per-sample simplified silhouette, where the mean intra and nearest inter cluster distances are
+    replaced by the distances to the own and nearest other centroid. Costs O(n·k) instead of O(n²).
+
+    Parameters
+    -
+    - X: numpy array with clustered data
+    - labels: cluster label of each sample
+    - centroids: cluster centers, indexed by label
+    - sample_weight: (default None) number of players represented by each sample
+    - single_member_zero: (default True) scores single member clusters 0. Set it to False when X
+        is a chunk of the data, whose cluster counts aren't the global ones
+    """
+    dist = euclidean_distances(X, centroids)
+    rows = np.arange(len(X))
+
+    a = dist[rows, labels]
+    dist[rows, labels] = np.inf
+    b = dist.min(axis=1)
+
+    denom = np.maximum(a, b)
+    samples = np.divide(b - a, denom, out=np.zeros_like(a), where=denom > 0)
+
+    # single member clusters score 0, same as sklearn silhouette_samples
+    if single_member_zero:
+        counts = np.bincount(labels, weights=sample_weight, minlength=len(centroids))
+        samples[counts[labels] <= 1] = 0
+
+    return samples
+
+# exact silhouette of many labellings from a single distance pass
+def silhouette_samples_shared(X : np.array, label_sets : list[np.array], sample_weight : np.array = None,
+                              max_bytes : int = 2**27) -> list[np.array]:
+    """
+    Function
+    -
+    Exact per-sample silhouettes for several labellings of the same X. Pairwise distances are
+    computed once, by row chunks of about max_bytes, and each chunk is reused to score every
+    labelling, instead of recomputing all distances for each one.
+
+    Parameters
+    -
+    - X: numpy array with clustered data
+    - label_sets: list of label arrays, one for each labelling (e.g. each k of a sweep)
+    - sample_weight: (default None) number of identical players represented by each sample. The
+        results are then equal to sklearn silhouette_samples over the expanded data
+    - max_bytes: (default 128 MiB) memory bound of each distance chunk and its copies
+    """
+    n = len(X)
+    weight = np.ones(n) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+
+    # columns sorted by cluster, so cluster sums are contiguous reduceat slices
+    codes = [np.unique(labels, return_inverse=True)[1].ravel() for labels in label_sets]
+    orders = [np.argsort(c, kind='stable') for c in codes]
+    starts = [np.searchsorted(c[o], np.arange(c.max() + 1)) for c, o in zip(codes, orders)]
+    cluster_weights = [np.bincount(c, weights=weight) for c in codes]
+
+    samples = [np.zeros(n) for _ in label_sets]
+    chunk = max(1, max_bytes // (3 * 8 * n))
+
+    for start in range(0, n, chunk):
+        stop = min(start + chunk, n)
+        rows = np.arange(stop - start)
+        weighted_dist = euclidean_distances(X[start:stop], X) * weight
+
+        for i, (c, order, c_starts, c_weight) in enumerate(zip(codes, orders, starts, cluster_weights)):
+            sums = np.add.reduceat(weighted_dist[:, order], c_starts, axis=1)
+            labels = c[start:stop]
+
+            # own cluster mean excludes the player itself (its duplicates are at distance 0)
+            own_weight = c_weight[labels]
+            a = np.divide(sums[rows, labels], own_weight - 1, out=np.zeros(len(rows)), where=own_weight > 1)
+
+            other = sums / c_weight
+            other[rows, labels] = np.inf
+            b = other.min(axis=1)
+
+            denom = np.maximum(a, b)
+            s_chunk = np.divide(b - a, denom, out=np.zeros(len(rows)), where=denom > 0)
+            s_chunk[own_weight <= 1] = 0
+            samples[i][start:stop] = s_chunk
+
+    return samples
+
+# exact silhouette of weighted (deduplicated) samples
+def weighted_silhouette_samples(X : np.array, labels : np.array, sample_weight : np.array) -> np.array:
+    """
+    Function
+    -
+    Exact per-sample silhouette when each sample stands for sample_weight identical players.
+    Equal to sklearn silhouette_samples over the expanded data, at the cost of the unique points
+    only (see silhouette_samples_shared).
+    """
+    return silhouette_samples_shared(X, [labels], sample_weight)[0]
+
+# stratified subsample silhouette with confidence bounds
+def sampled_silhouette(X : np.array, labels : np.array, sample_size : int = 2000, n_rounds : int = 5,
+                       random_state : int = None, sample_weight : np.array = None) -> tuple[float, tuple[float, float]]:
+    """
+    Function
+    -
+    Average silhouette score estimated from stratified subsamples (each cluster keeps its share of
+    points, with at least two per cluster). Returns the mean score over all rounds and a 95%
+    confidence interval.
+
+    Parameters
+    -
+    - X: numpy array with clustered data
+    - labels: cluster label of each sample
+    - sample_size: (default 2000) number of points in each subsample
+    - n_rounds: (default 5) number of independent subsamples
+    - random_state: seed for the subsample selection
+    - sample_weight: (default None) number of players represented by each sample, subsamples
+        are then scored as weighted samples
+    """
+    def score_of(idx):
+        w = None if sample_weight is None else sample_weight[idx]
+        samples = silhouette_samples_shared(X[idx], [labels[idx]], w)[0]
+        return np.average(samples, weights=w)
+
+    if len(X) <= sample_size:
+        score = score_of(np.arange(len(X)))
+        return score, (score, score)
+
+    rng = np.random.default_rng(random_state)
+    clusters, counts = np.unique(labels, return_counts=True)
+    # at least two points per cluster, so subsamples always have more points than labels
+    quota = np.maximum(2, np.round(counts / len(X) * sample_size).astype(int))
+    members = [np.flatnonzero(labels == c) for c in clusters]
+
+    scores = []
+    for _ in range(n_rounds):
+        idx = np.concatenate([rng.choice(m, size=min(q, len(m)), replace=False)
+                              for m, q in zip(members, quota)])
+        scores.append(score_of(idx))
+
+    scores = np.array(scores)
+    mean = scores.mean()
+    half_width = 1.96 * scores.std(ddof=1) / np.sqrt(n_rounds) if n_rounds > 1 else 0.
+
+    return mean, (mean - half_width, mean + half_width)
+
+# silhouette evaluation of one labelling
+def silhouette_eval(X : np.array, labels : np.array, centroids : np.array, mode : str = 'exact',
+                    sample_size : int = 2000, n_rounds : int = 5, random_state : int = None,
+                    sample_weight : np.array = None) -> tuple:
+    """
+    Function
+    -
+    Per-sample silhouette values, average silhouette score and its bounds for a single labelling.
+
+    Parameters
+    -
+    - X: numpy array with clustered data
+    - labels: cluster label of each sample
+    - centroids: cluster centers, indexed by label
+    - mode: 'exact' (pairwise silhouette, see silhouette_samples_shared), 'sampled' (stratified subsample score with
+        confidence bounds, simplified per-sample values), 'simplified' (centroid distances only)
+        or None (not evaluated)
+    - sample_size, n_rounds, random_state: subsample params used by 'sampled' mode
+    - sample_weight: (default None) number of players represented by each sample, the average
+        score is then weighted
+    """
+    match mode:
+        case 'exact':
+            samples = silhouette_samples_shared(X, [labels], sample_weight)[0]
+            sil_score = np.average(samples, weights=sample_weight)
+            bounds = (sil_score, sil_score)
+        case None:
+            return None, None, None
+        case 'sampled':
+            samples = simplified_silhouette(X, labels, centroids, sample_weight)
+            sil_score, bounds = sampled_silhouette(X, labels, sample_size, n_rounds, random_state, sample_weight)
+        case 'simplified':
+            samples = simplified_silhouette(X, labels, centroids, sample_weight)
+            sil_score = np.average(samples, weights=sample_weight)
+            bounds = (sil_score, sil_score)
+        case _:
+            raise ValueError(f"Unknown silhouette mode: {mode}")
+
+    return samples, sil_score, bounds
+
+# single k fit and evaluation
+def kmeans_fit_eval(X : np.array, n_clusters : int, mode : str = 'exact', sample_size : int = 2000,
+                    n_rounds : int = 5, random_state : int = None, init : str | np.ndarray = 'k-means++',
+                    sample_weight : np.array = None, minibatch : bool = False) -> tuple:
+    """
+    Function
+    -
+    Fits KMeans with n_clusters and evaluates its silhouette (see silhouette_eval). Returns labels,
+    samples, centroids, average silhouette, silhouette bounds and inertia. If init is an array of
+    initial centroids, a single init is run from them. sample_weight is used both in the fit
+    and in the silhouette. With minibatch, MiniBatchKMeans is fitted instead.
+    """
+    model = MiniBatchKMeans if minibatch else KMeans
+    if isinstance(init, np.ndarray):
+        kmeans = model(n_clusters = n_clusters, init = init, n_init = 1)
+    else:
+        kmeans = model(n_clusters = n_clusters, init = init)
+    labels = kmeans.fit_predict(X, sample_weight = sample_weight)
+    samples, sil_score, bounds = silhouette_eval(X, labels, kmeans.cluster_centers_, mode = mode,
+                                                 sample_size = sample_size, n_rounds = n_rounds,
+                                                 random_state = random_state, sample_weight = sample_weight)
+
+    return labels, samples, kmeans.cluster_centers_, sil_score, bounds, kmeans.inertia_
+
+# worker: single k fit with limited BLAS/OpenMP threads
+def _limited_fit_eval(X : np.array, n_clusters : int, blas_threads : int, **eval_params) -> tuple:
+    with threadpool_limits(limits = blas_threads):
+        return kmeans_fit_eval(X, n_clusters, **eval_params)
+
+# parallel k sweep
+def kmeans_parallel_sweep(X : np.array, k_range : range, n_jobs : int = -1, blas_threads : int = None,
+                          backend : str = 'loky', **eval_params) -> list[tuple]:
+    """
+    Function
+    -
+    Fits and evaluates every k in k_range in a joblib pool. With process backends X is memory
+    mapped read-only into shared memory (/dev/shm) once instead of being copied to each worker.
+    Results are returned in k_range order.
+
+    Parameters
+    -
+    - X: numpy array with data to cluster with KMeans
+    - k_range: numbers of clusters to evaluate
+    - n_jobs: (default -1) number of workers, all cores if -1
+    - blas_threads: (default None) BLAS/OpenMP threads per worker, cores // workers if None
+    - backend: (default 'loky') joblib backend, 'loky', 'multiprocessing' or 'threading'
+    - eval_params: kmeans_fit_eval params (mode, sample_size, n_rounds, random_state, sample_weight)
+    """
+    workers = cpu_count() if n_jobs == -1 else n_jobs
+    if blas_threads is None:
+        blas_threads = max(1, cpu_count() // workers)
+
+    pool = Parallel(n_jobs = workers, backend = backend, max_nbytes = 0, mmap_mode = 'r')
+
+    # threads share the process thread pools, so the limit is set once around the pool
+    if backend == 'threading':
+        with threadpool_limits(limits = blas_threads):
+            return pool(delayed(kmeans_fit_eval)(X, k, **eval_params) for k in k_range)
+
+    return pool(delayed(_limited_fit_eval)(X, k, blas_threads, **eval_params) for k in k_range)
+
+# new centroids for a warm started k+1 fit
+def split_centroid(X : np.array, labels : np.array, centroids : np.array, sample_weight : np.array = None,
+                   random_state : int = None) -> np.array:
+    """
+    Function
+    -
+    Bisecting split seeding: the cluster with the highest inertia is split with a 2-means fit
+    over its members, and its centroid is replaced by the two child centroids.
+    """
+    sq_dist = ((X - centroids[labels])**2).sum(axis=1)
+    weighted_sq_dist = sq_dist if sample_weight is None else sq_dist * sample_weight
+    cluster_sse = np.bincount(labels, weights=weighted_sq_dist, minlength=len(centroids))
+
+    parent = np.argmax(cluster_sse)
+    members = np.flatnonzero(labels == parent)
+    member_weight = None if sample_weight is None else sample_weight[members]
+    children = KMeans(n_clusters = 2, n_init = 1, random_state = random_state)\
+        .fit(X[members], sample_weight = member_weight).cluster_centers_
+
+    return np.vstack([np.delete(centroids, parent, axis=0), children])
+
+# warm started k sweep
+def kmeans_warm_sweep(X : np.array, k_range : range, **eval_params):
+    """
+    Function
+    -
+    Generator of kmeans_fit_eval results for each k in k_range (consecutive values), where the
+    first k is fitted with k-means++ and every next k is seeded from the previous centroids, with
+    the highest inertia cluster bisected (see split_centroid), so each fit starts close to
+    convergence.
+    """
+    init = 'k-means++'
+    for k in k_range:
+        result = kmeans_fit_eval(X, k, init = init, **eval_params)
+        labels, centroids = result[0], result[2]
+        init = split_centroid(X, labels, centroids, eval_params.get('sample_weight'),
+                              random_state = eval_params.get('random_state'))
+
+        yield result
+
 # Best params selector for unsupervised kmeans
 
-def kmeans_silhouette_score_eval(X : np.array) -> list:
+def kmeans_silhouette_score_eval(X : np.array, mode : str = 'auto', approx_threshold : int = 10000,
+                                 sample_size : int = 2000, n_rounds : int = 5, k_max : int = None,
+                                 random_state : int = None, n_jobs : int = 1, blas_threads : int = None,
+                                 backend : str = 'loky', warm_start : bool = False, dedup : bool = False,
+                                 max_bytes : int = 2**27, progress = None) -> list:
     """
     Function
     -
@@ -43,26 +411,96 @@ def kmeans_silhouette_score_eval(X : np.array) -> list:
     Parameters
     -
     - X: numpy array with data to cluster with KMeans
+    - mode: (default 'auto') silhouette evaluation, 'exact', 'sampled' or 'simplified' (see
+        silhouette_eval). 'auto' uses 'exact' up to approx_threshold samples and 'sampled' above it
+    - approx_threshold: (default 10000) number of samples from where 'auto' mode is approximate
+    - sample_size, n_rounds: subsample params for 'sampled' mode
+    - k_max: (default None) highest number of clusters evaluated, len(X)-1 if None
+    - random_state: seed for approximate modes subsamples
+    - n_jobs: (default 1) workers for the k sweep, sequential if 1 (see kmeans_parallel_sweep)
+    - blas_threads, backend: parallel sweep params (see kmeans_parallel_sweep)
+    - warm_start: (default False) seeds each k from the k-1 centroids (see kmeans_warm_sweep).
+        The sweep is sequential, so n_jobs is ignored
+    - dedup: (default False) clusters the unique feature points weighted by their player counts,
+        with the same inertias and silhouettes as the full data (see weighted_silhouette_samples)
+    - max_bytes: (default 128 MiB) memory bound of the exact silhouette distance chunks and of the
+        labellings scored together (see silhouette_samples_shared)
+    - progress: (default None) callable(done, total) called after each k value is fitted, and in
+        exact mode after each k value is scored
     """
+    # unique points and player counts
+    if dedup:
+        X_fit, counts = np.unique(X, axis=0, return_counts=True)
+        sample_weight = counts.astype(float)
+    else:
+        X_fit, sample_weight = X, None
 
-    # evaluate silhouette best score and n_clusters
-    clusters, label_l, sample_l, c_centers, avg_sil_score, inertias = [], [], [], [], [], []
+    if mode == 'auto':
+        mode = 'exact' if len(X_fit) <= approx_threshold else 'sampled'
 
-    for n_clusters in range(2, len(X)):
-        kmeans = KMeans(n_clusters = n_clusters)
-        labels = kmeans.fit_predict(X)
-        samples = silhouette_samples(X, labels)
-        sil_score = silhouette_score(X, labels)
-        centroid_innertia = kmeans.inertia_
-        centroids = kmeans.cluster_centers_
+    if k_max is None:
+        k_max = len(X) - 1
 
+    # evaluate silhouette best score and n_clusters
+    clusters, c_centers, avg_sil_score, sil_bounds, inertias = [], [], [], [], []
+
+    k_range = range(2, min(k_max, len(X) - 1, len(X_fit)) + 1)
+    # at least 3 players with 2 distinct feature points
+    n_distinct = len(X_fit) if dedup else len(np.unique(X, axis=0))
+    if len(k_range) == 0 or n_distinct < 2:
+        raise ValueError(f"Not enough distinct players to cluster: {len(X)} players, "+
+                         f"{n_distinct} distinct feature points")
+    # exact silhouettes are scored after the fits, sharing distance passes between k values
+    eval_params = dict(mode = None if mode == 'exact' else mode, sample_size = sample_size, n_rounds = n_rounds, random_state = random_state,
+                       sample_weight = sample_weight)
+
+    if warm_start:
+        results = kmeans_warm_sweep(X_fit, k_range, **eval_params)
+    elif n_jobs == 1:
+        results = (kmeans_fit_eval(X_fit, k, **eval_params) for k in k_range)
+    else:
+        results = kmeans_parallel_sweep(X_fit, k_range, n_jobs = n_jobs, blas_threads = blas_threads,
+                                        backend = backend, **eval_params)
+
+    # progress steps: fits, and exact scores made after them
+    def report() -> None:
+        if progress is not None:
+            if mode == 'exact':
+                progress(len(clusters) + len(avg_sil_score), 2 * len(k_range))
+            else:
+                progress(len(clusters), len(k_range))
+
+    # exact scores of pending labellings, one distance pass per batch of labellings
+    pending_labels = []
+    batch = max(1, max_bytes // (8 * len(X_fit)))
+
+    def score_pending() -> None:
+        for samples in silhouette_samples_shared(X_fit, pending_labels, sample_weight, max_bytes = max_bytes):
+            sil_score = np.average(samples, weights=sample_weight)
+            avg_sil_score.append(sil_score)
+            sil_bounds.append((sil_score, sil_score))
+            report()
+        pending_labels.clear()
+
+    # only compact summaries are kept, labels and samples are recomputed with cluster_labels_samples
+    for n_clusters, (labels, _, centroids, sil_score, bounds, centroid_innertia) in zip(k_range, results):
         clusters.append(n_clusters)
-        label_l.append(labels) # list of labels (list)
-        sample_l.append(samples) # list of samples (list)
         c_centers.append(centroids) # list of centroids (list)
-        avg_sil_score.append(sil_score)
         inertias.append(centroid_innertia) # list of inertias (list)
 
+        if mode == 'exact':
+            pending_labels.append(labels)
+            if len(pending_labels) == batch:
+                score_pending()
+        else:
+            avg_sil_score.append(sil_score)
+            sil_bounds.append(bounds) # list of score confidence bounds (tuple)
+
+        report()
+
+    if pending_labels:
+        score_pending()
+
     # sort together to get best score with clusters
     eval = pd.DataFrame({'n_clusters' : clusters,
                 'silhouette_score' : avg_sil_score}
@@ -74,28 +512,623 @@ def kmeans_silhouette_score_eval(X : np.array) -> list:
     # build dict with all data
     kmean_outputs : dict = {
         'clusters'  : clusters,
-        'labels'    : label_l,
-        'samples'   : sample_l,
         'centroids' : c_centers,
         'silhouette': avg_sil_score,
-        'inertias'  : inertias
+        'silhouette_bounds': sil_bounds,
+        'inertias'  : inertias,
+        'mode'      : mode,
+        'dedup'     : dedup
     }
 
     return avg_sil_score_eval, clusters_eval, kmean_outputs
 #----------------------------------------------------------------------------------
 
+# Inertia-only selection of k (knee)
+
+# knee of a decreasing inertia curve
+def knee_point(n_clusters : list[int], inertias : list[float]) -> int:
+    """
+    Function
+    -
+    Number of clusters at the knee of the inertia (elbow) curve, found as the point farthest below
+    the line joining both ends of the normalized curve (Kneedle).
+    """
+    x = np.asarray(n_clusters, dtype=float)
+    y = np.asarray(inertias, dtype=float)
+    if len(x) < 3 or y[0] == y[-1]:
+        return int(x[0])
+
+    x_n = (x - x[0]) / (x[-1] - x[0])
+    y_n = (y - y[-1]) / (y[0] - y[-1])
+
+    return int(x[np.argmax((1 - x_n) - y_n)])
+
+def kmeans_knee_eval(X : np.array, k_max : int = 10, neighbours : int = 1, mode : str = 'auto',
+                     approx_threshold : int = 10000, sample_size : int = 2000, n_rounds : int = 5,
+                     random_state : int = None, warm_start : bool = True, minibatch : bool = False,
+                     dedup : bool = False, progress = None) -> list:
+    """
+    Function
+    -
+    Cheap alternative to kmeans_silhouette_score_eval: fits only the inertias from 2 to k_max,
+    finds their knee (see knee_point) and evaluates the silhouette of the knee and its neighbours
+    only, returning the best of them. Same outputs as kmeans_silhouette_score_eval, with NaN
+    silhouettes for the k values that weren't evaluated.
+
+    Parameters
+    -
+    - X: numpy array with data to cluster with KMeans
+    - k_max: (default 10) highest number of clusters fitted
+    - neighbours: (default 1) k values evaluated at each side of the knee
+    - mode, approx_threshold, sample_size, n_rounds, random_state, dedup: see
+        kmeans_silhouette_score_eval
+    - warm_start: (default True) seeds each k from the k-1 centroids (see kmeans_warm_sweep)
+    - minibatch: (default False) fits MiniBatchKMeans instead of KMeans
+    - progress: (default None) callable(done, total) called after each k value is fitted and
+        each knee candidate is scored
+    """
+    if dedup:
+        X_fit, counts = np.unique(X, axis=0, return_counts=True)
+        sample_weight = counts.astype(float)
+    else:
+        X_fit, sample_weight = X, None
+
+    if mode == 'auto':
+        mode = 'exact' if len(X_fit) <= approx_threshold else 'sampled'
+
+    k_range = range(2, min(k_max, len(X) - 1, len(X_fit)) + 1)
+    # at least 3 players with 2 distinct feature points
+    n_distinct = len(X_fit) if dedup else len(np.unique(X, axis=0))
+    if len(k_range) == 0 or n_distinct < 2:
+        raise ValueError(f"Not enough distinct players to cluster: {len(X)} players, "+
+                         f"{n_distinct} distinct feature points")
+    fit_params = dict(mode = None, sample_weight = sample_weight, minibatch = minibatch)
+
+    if warm_start:
+        results = kmeans_warm_sweep(X_fit, k_range, **fit_params)
+    else:
+        results = (kmeans_fit_eval(X_fit, k, **fit_params) for k in k_range)
+
+    clusters, c_centers, inertias = [], [], []
+    for n_clusters, (_, _, centroids, _, _, centroid_innertia) in zip(k_range, results):
+        clusters.append(n_clusters)
+        c_centers.append(centroids)
+        inertias.append(centroid_innertia)
+
+        # knee candidates are scored after the fits
+        if progress is not None:
+            progress(len(clusters), len(k_range) + 2 * neighbours + 1)
+
+    # silhouettes of the knee and its neighbours only
+    knee = knee_point(clusters, inertias)
+    candidates = [k for k in range(knee - neighbours, knee + neighbours + 1) if k in clusters]
+    label_sets = [euclidean_distances(X_fit, c_centers[k-2]).argmin(axis=1) for k in candidates]
+
+    avg_sil_score = [np.nan for _ in clusters]
+    sil_bounds = [(np.nan, np.nan) for _ in clusters]
+
+    if mode == 'exact':
+        for i, (k, samples) in enumerate(zip(candidates, silhouette_samples_shared(X_fit, label_sets, sample_weight))):
+            avg_sil_score[k-2] = np.average(samples, weights=sample_weight)
+            sil_bounds[k-2] = (avg_sil_score[k-2], avg_sil_score[k-2])
+            if progress is not None:
+                progress(len(clusters) + i + 1, len(clusters) + len(candidates))
+    else:
+        for i, (k, labels) in enumerate(zip(candidates, label_sets)):
+            _, avg_sil_score[k-2], sil_bounds[k-2] = silhouette_eval(X_fit, labels, c_centers[k-2], mode = mode,
+                                                                     sample_size = sample_size, n_rounds = n_rounds,
+                                                                     random_state = random_state,
+                                                                     sample_weight = sample_weight)
+            if progress is not None:
+                progress(len(clusters) + i + 1, len(clusters) + len(candidates))
+
+    clusters_eval = max(candidates, key = lambda k: avg_sil_score[k-2])
+
+    kmean_outputs : dict = {
+        'clusters'  : clusters,
+        'centroids' : c_centers,
+        'silhouette': avg_sil_score,
+        'silhouette_bounds': sil_bounds,
+        'inertias'  : inertias,
+        'mode'      : mode,
+        'dedup'     : dedup
+    }
+
+    return avg_sil_score[clusters_eval-2], clusters_eval, kmean_outputs
+
+#----------------------------------------------------------------------------------
+
+# Streaming segmentation (MiniBatchKMeans)
+
+# in-memory DataFrame, csv or parquet file read by chunks
+def read_chunks(path : str | pd.DataFrame, chunksize : int = 100000, columns : list = None):
+    if isinstance(path, pd.DataFrame):
+        data = path if columns is None else path[columns]
+        for start in range(0, len(data), chunksize):
+            yield data.iloc[start:start + chunksize]
+    elif path.endswith('.parquet'):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size = chunksize, columns = columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols = columns, chunksize = chunksize)
+
+# number of events in a file or DataFrame, read by chunks
+def count_events(path : str | pd.DataFrame, chunksize : int = 100000) -> int:
+    events = set()
+    for chunk in read_chunks(path, chunksize, columns=['event_game']):
+        events.update(chunk['event_game'].unique())
+
+    return len(events)
+
+# preprocessed feature chunks from disaggregated data
+def feature_chunks(path : str | pd.DataFrame, n_events : int, chunksize : int = 100000):
+    """
+    Function
+    -
+    Generator of (X, df_clust_data) chunks, preprocessed from disaggregated data (in-memory
+    DataFrame, csv or parquet file) read by chunks. The rows of the last player in each chunk are
+    carried to the next one, so the rows of each player must be contiguous (as in simulated data).
+
+    Parameters
+    -
+    - path: disaggregated DataFrame, or csv or parquet path
+    - n_events: total number of events in the file (see count_events)
+    - chunksize: (default 100000) number of rows read at a time
+    """
+    carry = None
+    for chunk in read_chunks(path, chunksize):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+
+        last_player = chunk['player_id'].iat[-1]
+        carry = chunk[chunk['player_id'] == last_player]
+        chunk = chunk[chunk['player_id'] != last_player]
+
+        if len(chunk) > 0:
+            yield preprocess(chunk, n_events = n_events)
+
+    if carry is not None and len(carry) > 0:
+        yield preprocess(carry, n_events = n_events)
+
+# first pass: incremental fit of every k
+def kmeans_minibatch_sweep(chunks, k_max : int = 10, batch_size : int = 1024, n_passes : int = 3,
+                           random_state : int = None) -> dict:
+    """
+    Function
+    -
+    Fits one MiniBatchKMeans per number of clusters with partial_fit, reading the feature chunks
+    n_passes times. Each chunk is split in minibatches of batch_size rows, one update each. Only a
+    chunk is held in memory at a time.
+
+    Parameters
+    -
+    - chunks: callable returning a new iterator of (X, df_clust_data) chunks
+    - k_max: (default 10) highest number of clusters fitted
+    - batch_size: (default 1024) rows of each minibatch update
+    - n_passes: (default 3) passes over the chunks, small player bases fit in a single minibatch
+    - random_state: MiniBatchKMeans seed
+    """
+    models = {k : MiniBatchKMeans(n_clusters = k, batch_size = batch_size, n_init = 3,
+                                  random_state = random_state)
+              for k in range(2, k_max + 1)}
+
+    for _ in range(n_passes):
+        for X_chunk, _ in chunks():
+            for start in range(0, len(X_chunk), batch_size):
+                X_batch = X_chunk[start:start + batch_size]
+                for k, model in models.items():
+                    # first call needs at least k samples to initialize centroids
+                    if hasattr(model, 'cluster_centers_') or len(X_batch) >= k:
+                        model.partial_fit(X_batch)
+
+    return {k : model for k, model in models.items() if hasattr(model, 'cluster_centers_')}
+
+# streaming evaluation, same outputs as kmeans_silhouette_score_eval
+def kmeans_streaming_eval(chunks, k_max : int = 10, batch_size : int = 1024, n_passes : int = 3,
+                          random_state : int = None) -> list:
+    """
+    Function
+    -
+    Streaming alternative to preprocess + kmeans_silhouette_score_eval. Centroids are fitted in
+    first passes over the feature chunks and players are labelled in a last one, where inertias
+    and simplified silhouettes (see simplified_silhouette) are accumulated by chunk. Labels and
+    samples are not kept (see cluster_labels_samples).
+
+    Memory is bounded by the raw event rows of a chunk: raw rows are never loaded at once, but the
+    per-player features (X, df_clust_data, one row per player) of every chunk are kept, since
+    the segmentation plots show every player.
+
+    Parameters
+    -
+    - chunks: callable returning a new iterator of (X, df_clust_data) chunks
+    - k_max, batch_size, n_passes, random_state: see kmeans_minibatch_sweep
+
+    Output
+    -
+    X, df_clust_data, best average silhouette, best number of clusters and the kmean_outputs dict
+    """
+    models = kmeans_minibatch_sweep(chunks, k_max = k_max, batch_size = batch_size, n_passes = n_passes,
+                                    random_state = random_state)
+    clusters = list(models.keys())
+
+    X_l, df_l = [], []
+    # silhouette sums and member counts by cluster, single member clusters are known at the end
+    sil_sums = {k : np.zeros(k) for k in clusters}
+    counts = {k : np.zeros(k) for k in clusters}
+    inertias = {k : 0. for k in clusters}
+
+    # labelling pass: raw rows by chunk, per-player features kept for the plots
+    for X_chunk, df_chunk in chunks():
+        X_l.append(X_chunk)
+        df_l.append(df_chunk)
+        for k in clusters:
+            centroids = models[k].cluster_centers_
+            labels = models[k].predict(X_chunk)
+            samples = simplified_silhouette(X_chunk, labels, centroids, single_member_zero = False)
+            sil_sums[k] += np.bincount(labels, weights = samples, minlength = k)
+            counts[k] += np.bincount(labels, minlength = k)
+            inertias[k] += ((X_chunk - centroids[labels])**2).sum()
+
+    X = np.concatenate(X_l)
+    df_clust_data = pd.concat(df_l, ignore_index=True)
+    # single member clusters score 0, same as simplified_silhouette over the whole data
+    avg_sil_score = [sil_sums[k][counts[k] > 1].sum() / len(X) for k in clusters]
+
+    best = int(np.argmax(avg_sil_score))
+
+    kmean_outputs : dict = {
+        'clusters'  : clusters,
+        'centroids' : [models[k].cluster_centers_ for k in clusters],
+        'silhouette': avg_sil_score,
+        'silhouette_bounds': [(score, score) for score in avg_sil_score],
+        'inertias'  : [inertias[k] for k in clusters],
+        'mode'      : 'simplified',
+        'dedup'     : False
+    }
+
+    return X, df_clust_data, avg_sil_score[best], clusters[best], kmean_outputs
+
+#----------------------------------------------------------------------------------
+
+# Lazy labels and samples for a chosen k
+
+_labels_samples_cache = LRUCache(maxsize = 8)
+_labels_samples_lock = Lock()
+
+def cluster_labels_samples(X : np.array, centroids : np.array, mode : str = 'exact', dedup : bool = False) -> tuple:
+    """
+    Function
+    -
+    Labels (nearest centroid) and silhouette samples of X for a single k, recomputed from the
+    centroids stored in kmean_outputs. Results are kept in a small LRU cache keyed by the content
+    of X and the centroids, so moving back to a recent k doesn't recompute them.
+
+    Parameters
+    -
+    - X: numpy array with clustered data
+    - centroids: centroids of the chosen k, kmean_outputs['centroids'][k-2]
+    - mode: silhouette mode used in the sweep, kmean_outputs['mode']. 'exact' samples are pairwise
+        silhouettes, other modes use simplified silhouettes (see silhouette_eval)
+    - dedup: evaluates unique points weighted by counts and broadcasts back, kmean_outputs['dedup']
+    """
+    key = (data_fingerprint(X, centroids), mode, dedup)
+    with _labels_samples_lock:
+        if key in _labels_samples_cache:
+            return _labels_samples_cache[key]
+
+    if dedup:
+        X_eval, inverse, counts = np.unique(X, axis=0, return_inverse=True, return_counts=True)
+        inverse, sample_weight = inverse.ravel(), counts.astype(float)
+    else:
+        X_eval, inverse, sample_weight = X, slice(None), None
+
+    # per-point values only, the sweep already has the (sampled) average scores
+    labels = euclidean_distances(X_eval, centroids).argmin(axis=1)
+    if mode == 'exact':
+        samples = silhouette_samples_shared(X_eval, [labels], sample_weight)[0]
+    else:
+        samples = simplified_silhouette(X_eval, labels, centroids, sample_weight)
+    labels, samples = labels[inverse], samples[inverse]
+
+    with _labels_samples_lock:
+        _labels_samples_cache[key] = (labels, samples)
+
+    return labels, samples
+
+#----------------------------------------------------------------------------------
+
+# Batch assignment of new players
+
+# nearest centroid with numpy only
+def nearest_centroid(X : np.array, centroids : np.array, centroids_sq : np.array = None) -> np.array:
+    """
+    Function
+    -
+    Index of the nearest centroid for each row of X, from the expansion |x|² - 2x·c + |c|² (the
+    |x|² term is the same for every centroid, so it's skipped).
+
+    Parameters
+    -
+    - X: numpy array with features, same columns as the centroids
+    - centroids: fitted KMeans centroids
+    - centroids_sq: (default None) precomputed squared norms of the centroids
+    """
+    if centroids_sq is None:
+        centroids_sq = (centroids**2).sum(axis=1)
+
+    return (centroids_sq - 2 * X @ centroids.T).argmin(axis=1)
+
+def cluster_assigner(centroids : np.array, n_events : int):
+    """
+    Function
+    -
+    Returns an assign(rows) function that labels batches of raw result rows (same columns as the
+    disaggregated data) without refitting: features are built as in preprocess and each player
+    gets its nearest centroid. The centroids are copied read-only, so assign can be called from
+    several threads at once.
+
+    Parameters
+    -
+    - centroids: fitted centroids, e.g. base_dataset output['centroids'][clust_eval-2]
+    - n_events: number of events of the fitted data, so participation keeps the same scale even
+        if a batch only has some events
+
+    Output
+    -
+    assign(rows: pd.DataFrame) -> pd.DataFrame, one row per player with its features and labels
+    """
+    centroids = np.array(centroids, dtype=float)
+    centroids.flags.writeable = False
+    centroids_sq = (centroids**2).sum(axis=1)
+    centroids_sq.flags.writeable = False
+
+    def assign(rows : pd.DataFrame) -> pd.DataFrame:
+        X, df_players, _ = build_features(rows, n_events = n_events)
+        df_players['labels'] = nearest_centroid(X, centroids, centroids_sq)
+
+        return df_players
+
+    return assign
+
+#----------------------------------------------------------------------------------
+
+# Persistent sweep cache
+
+SWEEP_CACHE_DIR = "sources/kmeans_cache"
+SWEEP_CACHE_MAX_FILES = 50
+# bumped when the sweep algorithms change their results
+SWEEP_CACHE_VERSION = 2
+
+def sweep_cache_key(X : np.array, **sweep_params) -> str:
+    """
+    Function
+    -
+    Content key of a k sweep: hash of the input features, the sweep params that change its
+    results, and the cache, numpy and scikit-learn versions.
+    """
+    params = repr((SWEEP_CACHE_VERSION, np.__version__, sklearn.__version__,
+                   sorted(sweep_params.items()))).encode()
+    return f"{data_fingerprint(X)}-{hashlib.blake2b(params, digest_size = 8).hexdigest()}"
+
+def load_sweep(key : str, cache_dir : str = SWEEP_CACHE_DIR) -> tuple | None:
+    """
+    Function
+    -
+    Loads (best silhouette, best number of clusters, kmean_outputs) stored with save_sweep, or
+    None if the key isn't cached (or the file can't be read). Files are plain numpy arrays,
+    read without pickle.
+    """
+    path = os.path.join(cache_dir, f"{key}.npz")
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with np.load(path, allow_pickle = False) as f:
+            clusters = f['clusters'].tolist()
+            kmean_outputs = {
+                'clusters'  : clusters,
+                'centroids' : np.split(f['centroids'], np.cumsum(clusters)[:-1]),
+                'silhouette': f['silhouette'].tolist(),
+                'silhouette_bounds': [tuple(b) for b in f['silhouette_bounds'].tolist()],
+                'inertias'  : f['inertias'].tolist(),
+                'mode'      : str(f['mode']),
+                'dedup'     : bool(f['dedup'])
+            }
+            sweep = float(f['sil_eval']), int(f['clust_eval']), kmean_outputs
+    except Exception:
+        return None
+
+    # recently read sweeps are the last ones pruned (see save_sweep)
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    return sweep
+
+def save_sweep(key : str, sweep : tuple, cache_dir : str = SWEEP_CACHE_DIR,
+               max_files : int = SWEEP_CACHE_MAX_FILES) -> None:
+    """
+    *Procedure*
+    -
+    Stores a kmeans_silhouette_score_eval result on disk as a .npz of numpy arrays. The file is
+    written to a temporary name and renamed, so other processes never read a partial file. Only
+    the max_files most recently written or read sweeps are kept, older ones are removed.
+    """
+    sil_eval, clust_eval, output = sweep
+
+    os.makedirs(cache_dir, exist_ok = True)
+    fd, tmp_path = tempfile.mkstemp(dir = cache_dir, suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, sil_eval = sil_eval, clust_eval = clust_eval,
+                     clusters = np.asarray(output['clusters'], dtype = int),
+                     centroids = np.concatenate(output['centroids']),
+                     silhouette = np.asarray(output['silhouette'], dtype = float),
+                     silhouette_bounds = np.asarray(output['silhouette_bounds'], dtype = float).reshape(-1, 2),
+                     inertias = np.asarray(output['inertias'], dtype = float),
+                     mode = np.asarray(output['mode'], dtype = str), dedup = output['dedup'])
+        os.replace(tmp_path, os.path.join(cache_dir, f"{key}.npz"))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # pickled sweeps of older versions are never read, they are removed too
+    old_files = sorted(glob.glob(os.path.join(cache_dir, "*.npz")), key = os.path.getmtime)
+    for old_path in old_files[:-max_files] + glob.glob(os.path.join(cache_dir, "*.joblib")):
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+
+#----------------------------------------------------------------------------------
+
 # Preprocess and usupervised clustering model application 
-@st.cache_data(ttl='1h')
-def base_dataset():
-    # load disaggregated data
-    base = pd.read_csv("sources/df_teams_disagg.csv")
+def segmentation(base : pd.DataFrame = None, data_path : str = "sources/df_teams_disagg.csv",
+                 silhouette_mode : str = 'auto', streaming : bool = False, chunksize : int = 100000,
+                 k_max : int = 10, n_jobs : int = 1, warm_start : bool = False, dedup : bool = True,
+                 selection : str = 'silhouette', progress = None):
+    """
+    Function
+    -
+    Preprocessed players data and kmeans evaluation outputs (X, df_clust_data, best score,
+    best k, kmean_outputs), or None when there are less than 3 players or 2 distinct feature
+    points to cluster.
+
+    Parameters
+    -
+    - base: in-memory disaggregated data, used as is
+    - data_path: disaggregated csv or parquet file, read when base is None
+    - silhouette_mode, n_jobs, warm_start, dedup: see kmeans_silhouette_score_eval
+    - streaming, chunksize: MiniBatchKMeans over chunks of chunksize rows (see kmeans_streaming_eval)
+    - k_max: max number of clusters for knee selection and streaming
+    - selection: 'silhouette' (full sweep) or 'knee' (see kmeans_knee_eval)
+    - progress: (default None) callable(done, total) called after each step of the sweep (see
+        kmeans_silhouette_score_eval and kmeans_knee_eval)
+    """
+    source = data_path if base is None else base
+
+    # streaming mode: MiniBatchKMeans over chunks, never preprocesses all raw rows at once
+    if streaming:
+        n_events = count_events(source, chunksize)
+        chunks = lambda: feature_chunks(source, n_events = n_events, chunksize = chunksize)
+
+        return kmeans_streaming_eval(chunks, k_max = k_max)
 
-    # preprocess and best params based on silhouette
+    # disaggregated data: session frame, or file (parquet or csv)
+    if base is None:
+        base = pd.read_parquet(data_path) if data_path.endswith('.parquet') else pd.read_csv(data_path)
+
+    # preprocess and best params based on silhouette (approximate for large player bases)
     X, df_clust_data = preprocess(base = base)
-    sil_eval, clust_eval, output = kmeans_silhouette_score_eval(X)
+
+    # no clusters when players share (almost) all the same features
+    if len(X) < 3 or len(np.unique(X, axis=0)) < 2:
+        return None
+
+    # fitted sweeps persist on disk across restarts and processes serving the same data
+    key = sweep_cache_key(X, mode = silhouette_mode, warm_start = warm_start, dedup = dedup,
+                          selection = selection, k_max = k_max if selection == 'knee' else None)
+    sweep = load_sweep(key)
+    if sweep is None:
+        # knee: inertia-only sweep up to k_max, silhouette around the knee only
+        if selection == 'knee':
+            sweep = kmeans_knee_eval(X, k_max = k_max, mode = silhouette_mode, dedup = dedup,
+                                     progress = progress)
+        else:
+            sweep = kmeans_silhouette_score_eval(X, mode = silhouette_mode, n_jobs = n_jobs,
+                                                 warm_start = warm_start, dedup = dedup,
+                                                 progress = progress)
+        save_sweep(key, sweep)
+    sil_eval, clust_eval, output = sweep
 
     return X, df_clust_data, sil_eval, clust_eval, output
 
+# no spinner: segmentation jobs call it from a background thread
+@st.cache_data(ttl='1h', show_spinner = False)
+def _cached_segmentation(_base : pd.DataFrame, data_key : str, _progress = None, **params):
+    return segmentation(base = _base, progress = _progress, **params)
+
+def base_dataset(_base : pd.DataFrame = None, data_key : str = None, data_path : str = "sources/df_teams_disagg.csv",
+                 silhouette_mode : str = 'auto', streaming : bool = False, chunksize : int = 100000,
+                 k_max : int = 10, n_jobs : int = 1, warm_start : bool = False, dedup : bool = True,
+                 selection : str = 'silhouette', _progress = None):
+    """
+    Function
+    -
+    segmentation outputs cached by Streamlit.
+
+    Parameters
+    -
+    - _base: in-memory disaggregated data of the session, used as is (not hashed by Streamlit)
+    - data_key: content fingerprint of _base (see graph_funct.data_fingerprint), its cache key.
+        Computed from _base when it isn't given, so different frames never share an entry
+    - _progress: segmentation progress callable, only called when the result isn't cached
+    - other params: see segmentation
+    """
+    if _base is not None and data_key is None:
+        data_key = data_fingerprint(_base)
+
+    return _cached_segmentation(_base, data_key, _progress, data_path = data_path, silhouette_mode = silhouette_mode,
+                                streaming = streaming, chunksize = chunksize, k_max = k_max, n_jobs = n_jobs,
+                                warm_start = warm_start, dedup = dedup, selection = selection)
+
+# Background segmentation-----------------------------------------------------------
+
+# KMeans and the distance kernels release the GIL, so threads overlap with the page reruns
+# without pickling the session data to another process
+SEGMENTATION_WORKERS = 2
+
+_segmentation_executor = ThreadPoolExecutor(max_workers = SEGMENTATION_WORKERS,
+                                            thread_name_prefix = 'segmentation')
+# finished jobs kept (least recently used first out), running jobs are never evicted
+SEGMENTATION_MAX_JOBS = 8
+_segmentation_jobs = {}
+_segmentation_lock = Lock()
+
+def segmentation_job(base : pd.DataFrame, data_key : str, retry : bool = False, **params) -> dict:
+    """
+    Function
+    -
+    Starts the segmentation of base in a background thread, or returns the job already started
+    for the same data and params. Failed jobs are kept (their future raises the error) until
+    they are retried.
+
+    Parameters
+    -
+    - base: in-memory disaggregated data of the session, used as is
+    - data_key: content fingerprint of base (see graph_funct.data_fingerprint), the job key
+    - retry: (default False) starts a failed job again
+    - params: segmentation params (see segmentation), the job runs base_dataset with them
+
+    Returns
+    -
+    Job dict: 'future' (concurrent.futures.Future with the segmentation outputs, shared between
+    sessions, so they must not be modified), 'done' and 'total' sweep steps (see segmentation)
+    """
+    key = (data_key, tuple(sorted(params.items())))
+
+    with _segmentation_lock:
+        job = _segmentation_jobs.pop(key, None)
+        failed = job is not None and job['future'].done() and job['future'].exception() is not None
+
+        if job is None or (retry and failed):
+            job = {'done' : 0, 'total' : None}
+
+            def progress(done : int, total : int) -> None:
+                job['done'], job['total'] = done, total
+
+            job['future'] = _segmentation_executor.submit(base_dataset, _base = base, data_key = data_key,
+                                                          _progress = progress, **params)
+
+        # most recently used last
+        _segmentation_jobs[key] = job
+        finished = [k for k, j in _segmentation_jobs.items() if j['future'].done()]
+        for old_key in finished[:max(0, len(_segmentation_jobs) - SEGMENTATION_MAX_JOBS)]:
+            del _segmentation_jobs[old_key]
+
+    return job
+
 #----------------------------------------------------------------------------------
 
 # Results and Metrics Visualizations
@@ -136,6 +1169,52 @@ def contour_data(X, depth : list, v_margin : float|int = .35, h_margin : float|i
 
     return xrange, yrange, zrange
 
+# decision boundary mesh from centroids
+_boundary_cache = LRUCache(maxsize = 16)
+_boundary_lock = Lock()
+
+def boundary_mesh(X : np.array, centroids : np.array, v_margin : float|int = .35, h_margin : float|int = .35,
+                  max_cells : int = 40000) -> list[np.array]:
+    """
+    Function
+    -
+    Nearest centroid labels over a 2-D grid covering X, to draw the real cluster boundaries as a
+    contour. All grid points are assigned in one vectorized distance computation, the grid has
+    at most max_cells cells and results are cached by (X bounds, centroids), so moving back to a
+    previous number of clusters doesn't recompute it.
+
+    Parameters
+    -
+    - X: training features (2 columns: score and participation) applied in KMeans
+    - centroids: KMeans centroids for the chosen number of clusters
+    - v_margin, h_margin: (default .35) margins added to the y and x ranges
+    - max_cells: (default 40000) cap on the number of grid cells
+
+    Output
+    -
+    1-D x and y grid values and a 2-D (len(y), len(x)) array of labels for plotly contour traces
+    """
+    x_min, x_max = X[:,0].min() - h_margin, X[:,0].max() + h_margin
+    y_min, y_max = X[:,1].min() - v_margin, X[:,1].max() + v_margin
+    side = max(2, int(np.sqrt(max_cells)))
+
+    key = (data_fingerprint(np.array([x_min, x_max, y_min, y_max]), centroids), side)
+    with _boundary_lock:
+        if key in _boundary_cache:
+            return _boundary_cache[key]
+
+    xrange = np.linspace(x_min, x_max, side)
+    yrange = np.linspace(y_min, y_max, side)
+    xx, yy = np.meshgrid(xrange, yrange)
+
+    grid = np.column_stack([xx.ravel(), yy.ravel()])
+    zgrid = euclidean_distances(grid, centroids).argmin(axis=1).reshape(xx.shape)
+
+    with _boundary_lock:
+        _boundary_cache[key] = (xrange, yrange, zgrid)
+
+    return xrange, yrange, zgrid
+
 # contour trace for make_subplots
 def score_contour_trace(name: str, opacity: float, xrange: list[float], yrange: list[float],
                         zrange: list[float]) -> go.Contour:
@@ -153,7 +1232,8 @@ def score_contour_trace(name: str, opacity: float, xrange: list[float], yrange:
     - y: array or list of float values with the second (or main second) feature, must have
         the same length as the first feature
     - z: array or list of float values with KMeans output, wich can be scores or labels
-        range, and must have the same length as the first and second features
+        range, and must have the same length as the first and second features, or a 2-D array
+        (len(y), len(x)) like the boundary_mesh labels
     """
 
     colorscale = pio.templates[pio.templates.default]['layout']['colorscale']['sequential']
@@ -167,7 +1247,8 @@ def score_contour_trace(name: str, opacity: float, xrange: list[float], yrange:
 
 # kmean scatter figure
 def kmean_scatter(data : pd.DataFrame, category : list, sub_category : list, x : str, y : str, sub_cat_col : str, legendgroup: str,  size : str, sizescale : float,
-                  customdata : str, legend_title :str):
+                  customdata : str, legend_title :str, large_data : bool = None, gl_threshold : int = 5000,
+                  max_points : int = None, bin_points : bool = False):
     """
     Function
     -
@@ -186,6 +1267,12 @@ def kmean_scatter(data : pd.DataFrame, category : list, sub_category : list, x :
     - sizescale: marker size scalar
     - customdata: column used to display in hoverdata
     - legend_title: descriptive name of overal legend
+    - large_data: (default None) WebGL (Scattergl) traces if True, SVG if False, automatic from
+        gl_threshold rows if None
+    - gl_threshold: (default 5000) number of rows from where large_data is used
+    - max_points: (default None) random downsample of each trace to at most max_points markers
+    - bin_points: (default False) merges players on the same (x, y) point of each trace into a
+        single marker, showing the player count in hover instead of customdata
     """
     color = list(pio.templates[pio.templates.default]['layout']['colorway'])
     symbols = list(SymbolValidator().values[2::12])
@@ -196,12 +1283,32 @@ def kmean_scatter(data : pd.DataFrame, category : list, sub_category : list, x :
     while len(category) > len(symbols) or len(sub_category) > len(symbols):
         symbols.extend(symbols)
 
+    if large_data is None:
+        large_data = len(data) > gl_threshold
+    trace_type = go.Scattergl if large_data else go.Scatter
+
+    # single partition by (cluster, team)
+    groups = {key : group for key, group in data.groupby(['labels_desc', sub_cat_col], sort=False, observed=True)}
+    empty = data.iloc[:0]
+
+    hover_label = "players" if bin_points else customdata
+    rng = np.random.default_rng(0)
+
     scatter_fig = go.Figure()
 
     for sc_i in range(len(sub_category)):
         for c_i in range(len(category)):
-            data_filtered = data[data['labels_desc']== category[c_i]][data[sub_cat_col]== sub_category[sc_i]]
-            scatter_fig.add_trace(go.Scatter(
+            data_filtered = groups.get((category[c_i], sub_category[sc_i]), empty)
+
+            if bin_points:
+                binned = data_filtered.groupby([x, y], sort=False, as_index=False)
+                data_filtered = binned.size().rename(columns={'size' : hover_label})
+                if size not in (x, y):
+                    data_filtered[size] = binned[size].mean()[size].to_numpy()
+            if max_points is not None and len(data_filtered) > max_points:
+                data_filtered = data_filtered.iloc[np.sort(rng.choice(len(data_filtered), max_points, replace=False))]
+
+            scatter_fig.add_trace(trace_type(
                 x = data_filtered[x],
                 y = data_filtered[y],
                 name = f"{category[c_i]} - {sub_category[sc_i]}",
@@ -214,8 +1321,8 @@ def kmean_scatter(data : pd.DataFrame, category : list, sub_category : list, x :
                 marker_size = data_filtered[size]*sizescale,
                 marker_sizemode = 'diameter',
                 marker_symbol = symbols[sc_i],
-                customdata = data_filtered[customdata],
-                hovertemplate = f"<i>{customdata}: </i>" + "%{customdata}<br>" +
+                customdata = data_filtered[hover_label],
+                hovertemplate = f"<i>{hover_label}: </i>" + "%{customdata}<br>" +
                                 f"<b>{x}</b> "+"%{x} points<br>" +
                                 f"<b>{y}</b> "+"%{y:2.2%}" +
                                 "<extra></extra>"
@@ -229,9 +1336,10 @@ def kmean_scatter(data : pd.DataFrame, category : list, sub_category : list, x :
                                             ),
                               width = 1800, height = 600, margin = dict(t=0,b=30,l=0,r=0))
 
-    return scatter_fig
+    return compact_figure(scatter_fig)
 
 # Elbow plot
+@figure_cache
 def elbow_method_plot(n_clusters : list[int], inertias : list[float], umbral : int, t : int = 50,b : int = 30,l : int = 0,r : int = 0, show_title: bool = False, theme = 'plotly_white'):
 
     color = list(pio.templates[pio.templates.default]['layout']['colorway'])
@@ -285,11 +1393,14 @@ def elbow_method_plot(n_clusters : list[int], inertias : list[float], umbral : i
     return elb_fig
 
 # silhouette interactive figure
-def silhouette_figure(data : pd.DataFrame, score : float, clusters : int, t : int = 50,b : int = 30,l : int = 0,r : int = 0, show_title: bool = False, theme = 'plotly_white'):
+@figure_cache
+def silhouette_figure(data : pd.DataFrame, score : float, clusters : int, t : int = 50,b : int = 30,l : int = 0,r : int = 0, show_title: bool = False, theme = 'plotly_white',
+                      max_band_points : int = 500):
     """
     Function
     -
-    Shows silhouette analysis of a kmeans clustering result.
+    Shows silhouette analysis of a kmeans clustering result. Bands are contiguous slices of a single
+    lexsort by (cluster, sample value), and large clusters are downsampled to evenly spaced quantiles.
 
     Parameters
     -
@@ -298,22 +1409,28 @@ def silhouette_figure(data : pd.DataFrame, score : float, clusters : int, t : in
     - clusters: number of clusters that gave as result the best average silhouette score
     - t, b, l, r: plot margins (50, 30, 0, 0 by default)
     - theme: plotly theme to combine with default custom theme
+    - max_band_points: (default 500) max points drawn per cluster band, keeping its min, max and
+        quantiles in between. Band heights still match the cluster sizes
     """
     
     sil_fig = go.Figure()
-    y_lower = 0
 
-    for i in range(len(data['labels'].unique())):
-        cluster_size_i = data\
-            [data['labels']==data['labels'].unique()[i]]\
-            ['samples'].to_numpy().shape[0]
-        
-        y_upper = y_lower + cluster_size_i
+    # clusters in order of appearance, samples sorted within each cluster
+    codes, _ = pd.factorize(data['labels'])
+    samples = data['samples'].to_numpy()
+    order = np.lexsort((samples, codes))
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(codes))])
+
+    for i in range(len(bounds) - 1):
+        y_lower, y_upper = bounds[i], bounds[i+1]
+        band = np.arange(y_upper - y_lower)
+
+        if len(band) > max_band_points:
+            band = np.unique(np.linspace(0, len(band) - 1, max_band_points).round().astype(int))
 
         sil_fig.add_trace(go.Scatter(
-            x = data[data['labels']==data['labels'].unique()[i]]\
-                .sort_values('samples')['samples'],
-            y = np.arange(y_lower, y_upper),
+            x = samples[order[y_lower + band]],
+            y = y_lower + band,
             mode = 'lines',
             line_width=.5,
             fill = 'tozerox',
@@ -321,8 +1438,6 @@ def silhouette_figure(data : pd.DataFrame, score : float, clusters : int, t : in
             hovertemplate = f"<extra>cluster {i}</extra>"+"%{y}"
         ))
 
-        y_lower = y_upper
-
     sil_fig.add_vline(x= score,
                     annotation_text = f"Avg. <br>silhouette score:<br> {score:.4f}",
                     annotation_align = 'right',
@@ -343,13 +1458,15 @@ def silhouette_figure(data : pd.DataFrame, score : float, clusters : int, t : in
     return sil_fig
 
 # cluster composition barplot
+@figure_cache
 def cluster_composition(data : pd.DataFrame, cluster_col : str, group_col : str, color_order : list = None,
                         t : int = 50,b : int = 30,l : int = 0,r : int = 0,
                         show_title: bool = False, theme = 'plotly_white'):
     """
     Function
     -
-    Shows the composition of all clusters from kmeans output.
+    Shows the composition of all clusters from kmeans output: players per group and cluster
+    are counted in one crosstab, with one stacked trace per group.
     """
 
     color = list(pio.templates[pio.templates.default]['layout']['colorway'])
@@ -365,22 +1482,24 @@ def cluster_composition(data : pd.DataFrame, cluster_col : str, group_col : str,
     while len(color) < len(cluster_col_t): # prevent indexing error
         color.extend(color)
     
+    # players per group (rows) and cluster (columns), in a single pass
+    comp_counts = pd.crosstab(data[group_col], data[cluster_col])\
+    .reindex(index=group_col_t, columns=cluster_col_t, fill_value=0)
+    
     comp_bar = go.Figure()
 
-    for a in range(len(group_col_t)):
-        for b in range(len(cluster_col_t)):
-            aux_filter_data = data[data[cluster_col] == cluster_col_t[b]][data[group_col] == group_col_t[a]]
-
-            comp_bar.add_trace(go.Bar(
-                x = [cluster_col_t[b]],#aux_filter_data[cluster_col],
-                y = [len(aux_filter_data[group_col])],
-                #name = group_col_t[a]+'-'+cluster_col_t[b],
-                marker_color = color_map[group_col_t[a]],
-                marker_line_color = color[b], marker_line_width = 3,
-                showlegend= False,
-                customdata= [group_col_t[a]],
-                hovertemplate= "<extra></extra>Cluster: %{x}<br>Team: %{customdata}<br>N players: %{y}"
-            ))
+    # one stacked trace per group, bar outlines colored by cluster
+    for group, counts in comp_counts.iterrows():
+        comp_bar.add_trace(go.Bar(
+            x = cluster_col_t,
+            y = counts.to_numpy(),
+            name = str(group),
+            marker_color = color_map[group],
+            marker_line_color = color[:len(cluster_col_t)], marker_line_width = 3,
+            showlegend= False,
+            customdata= np.full(len(cluster_col_t), group, dtype=object),
+            hovertemplate= "<extra></extra>Cluster: %{x}<br>Team: %{customdata}<br>N players: %{y}"
+        ))
 
     comp_bar.update_xaxes(showticklabels = True, showgrid=False)
     comp_bar.update_yaxes(showticklabels = False, showgrid=False)
@@ -0,0 +1,99 @@
+import os
+import glob
+import queue
+import tempfile
+import warnings
+from threading import Lock, Thread
+
+import pandas as pd
+
+from modules.graph_funct import data_fingerprint
+
+
+# Session results persistence------------------------------------------------------
+
+# content-addressed files: "<name>-<fingerprint>.parquet", so sessions never overwrite each other
+RESULTS_DIR = "sources/results"
+RESULTS_MAX_FILES = 20
+
+_write_queue = queue.Queue()
+_write_pending = set()
+_write_lock = Lock()
+_writer = None
+
+def results_path(name : str, fingerprint : str, results_dir : str = RESULTS_DIR) -> str:
+    return os.path.join(results_dir, f"{name}-{fingerprint}.parquet")
+
+def _write_frame(path : str, frame : pd.DataFrame, max_files : int) -> None:
+    # temporary file and rename, readers never see a partial file
+    results_dir = os.path.dirname(path)
+    os.makedirs(results_dir, exist_ok = True)
+    fd, tmp_path = tempfile.mkstemp(dir = results_dir, suffix = '.tmp')
+    os.close(fd)
+    try:
+        frame.to_parquet(tmp_path, index = False)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    # keep the most recent files of each result name
+    name = os.path.basename(path).rsplit('-', 1)[0]
+    old_files = sorted(glob.glob(os.path.join(results_dir, f"{name}-*.parquet")), key = os.path.getmtime)
+    for old_path in old_files[:-max_files]:
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+
+def _writer_loop() -> None:
+    while True:
+        path, frame, max_files = _write_queue.get()
+        try:
+            _write_frame(path, frame, max_files)
+        except Exception as e:
+            warnings.warn(f"Could not persist {path}: {e}", RuntimeWarning)
+        finally:
+            with _write_lock:
+                _write_pending.discard(path)
+            _write_queue.task_done()
+
+def persist_frames(frames : dict[str, pd.DataFrame], results_dir : str = RESULTS_DIR,
+                   max_files : int = RESULTS_MAX_FILES) -> dict[str, str]:
+    """
+    Function
+    -
+    Queues DataFrames to be written as Parquet by a background thread, so reruns don't wait
+    for disk I/O. Paths are content-hashed: unchanged data (already written or queued) is
+    skipped, and concurrent sessions never overwrite each other's results.
+
+    Parameters
+    -
+    - frames: result name and DataFrame pairs
+    - results_dir: (default RESULTS_DIR) output directory
+    - max_files: (default RESULTS_MAX_FILES) files kept per result name, older ones are removed
+
+    Returns
+    -
+    Result name and Parquet path pairs
+    """
+    global _writer
+
+    paths = {}
+    with _write_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = Thread(target = _writer_loop, name = 'results-writer', daemon = True)
+            _writer.start()
+
+        for name, frame in frames.items():
+            path = results_path(name, data_fingerprint(frame), results_dir)
+            paths[name] = path
+
+            if path in _write_pending or os.path.exists(path):
+                continue
+            _write_pending.add(path)
+            _write_queue.put((path, frame.copy(), max_files))
+
+    return paths
+
+#----------------------------------------------------------------------------------